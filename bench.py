@@ -0,0 +1,267 @@
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from types import SimpleNamespace
+
+import main
+from storage import JsonBackend, StoreWriter
+
+CITIES = ['Москва', 'Санкт-Петербург', 'Новосибирск', 'Екатеринбург', 'Казань', 'Нижний Новгород', 'Челябинск',
+          'Самара', 'Омск', 'Ростов-на-Дону', 'Уфа', 'Красноярск', 'Воронеж', 'Пермь', 'Волгоград', 'Краснодар',
+          'Саратов', 'Тюмень', 'Тольятти', 'Ижевск', 'Барнаул', 'Ульяновск', 'Иркутск', 'Хабаровск', 'Ярославль',
+          'Владивосток', 'Махачкала', 'Томск', 'Оренбург', 'Кемерово']
+GENDERS = ['Транс-женщина', 'Транс-мужчина', 'Небинарная персона', 'Агендер']
+BIO_WORDS = ['музыка', 'книги', 'кино', 'игры', 'походы', 'кофе', 'аниме', 'рисование', 'программирование', 'йога',
+             'путешествия', 'кошки', 'собаки', 'театр', 'фотография', 'настолки', 'велосипед', 'готовка']
+BASE_ID = 100_000_000
+
+
+def generate_dataset(users, likes_per_user, blocks_per_user, matches_per_user, seed=42):
+    rng = random.Random(seed)
+    ids = [BASE_ID + i for i in range(users)]
+    data = {'seq': 0, 'users': [], 'likes': [], 'matches': [], 'blocked': [], 'reports': [], 'feedback': []}
+    for telegram_id in ids:
+        data['users'].append({
+            'telegram_id': telegram_id,
+            'username': f"user_{telegram_id}",
+            'name': f"Имя {telegram_id % 100000}",
+            'age': rng.randint(16, 17) if rng.random() < 0.1 else rng.randint(18, 60),
+            'gender': rng.choice(GENDERS),
+            'city': rng.choice(CITIES) if rng.random() > 0.1 else None,
+            'bio': ' '.join(rng.sample(BIO_WORDS, 4)),
+            'photo_id': f"AgACAgIAAxkBAAI{telegram_id:x}",
+        })
+    for _ in range(int(users * likes_per_user)):
+        data['likes'].append({'liker_id': rng.choice(ids), 'liked_id': rng.choice(ids)})
+    for _ in range(int(users * matches_per_user)):
+        a, b = rng.sample(ids, 2)
+        data['matches'].append({'user1_id': min(a, b), 'user2_id': max(a, b)})
+    for _ in range(int(users * blocks_per_user)):
+        data['blocked'].append({'blocker_id': rng.choice(ids), 'blocked_id': rng.choice(ids)})
+    return data
+
+
+class FakeMessage:
+    def __init__(self, bot, chat_id, message_id=1, text=None, caption=None):
+        self._bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.text = text
+        self.caption = caption
+        self.photo = []
+        self.reply_markup = None
+        self.from_user = SimpleNamespace(id=chat_id, username=None)
+
+    async def reply_text(self, text, **kwargs):
+        return await self._bot.send_message(self.chat_id, text, **kwargs)
+
+    async def delete(self):
+        return await self._bot.delete_message(chat_id=self.chat_id, message_id=self.message_id)
+
+
+class FakeQuery:
+    def __init__(self, bot, user_id, data):
+        self._bot = bot
+        self.data = data
+        self.from_user = SimpleNamespace(id=user_id, username=None)
+        self.message = FakeMessage(bot, user_id, caption="Имя: ...")
+
+    async def answer(self, *args, **kwargs):
+        self._bot.calls['answer_callback_query'] += 1
+
+    async def edit_message_media(self, *args, **kwargs):
+        self._bot.calls['edit_message_media'] += 1
+
+    async def edit_message_caption(self, *args, **kwargs):
+        self._bot.calls['edit_message_caption'] += 1
+
+    async def edit_message_reply_markup(self, *args, **kwargs):
+        self._bot.calls['edit_message_reply_markup'] += 1
+
+    async def edit_message_text(self, *args, **kwargs):
+        self._bot.calls['edit_message_text'] += 1
+
+
+class StubBot:
+    def __init__(self):
+        self.calls = Counter()
+        self._message_id = 0
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        async def call(*args, **kwargs):
+            self.calls[name] += 1
+            self._message_id += 1
+            chat_id = kwargs.get('chat_id', args[0] if args else 0)
+            return FakeMessage(self, chat_id, self._message_id)
+        return call
+
+
+class StubOutbox:
+    def __init__(self):
+        self.calls = Counter()
+
+    def __getattr__(self, name):
+        def enqueue(*args, **kwargs):
+            self.calls[name] += 1
+        return enqueue
+
+
+def callback_update(bot, user_id, data):
+    query = FakeQuery(bot, user_id, data)
+    return SimpleNamespace(callback_query=query, message=None, effective_user=query.from_user,
+                           effective_chat=SimpleNamespace(id=user_id))
+
+
+def message_update(bot, user_id, text):
+    message = FakeMessage(bot, user_id, text=text)
+    return SimpleNamespace(callback_query=None, message=message, effective_user=message.from_user,
+                           effective_chat=SimpleNamespace(id=user_id))
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+    return {'p50': pick(0.5), 'p90': pick(0.9), 'p99': pick(0.99), 'max': ordered[-1] * 1000,
+            'mean': statistics.mean(ordered) * 1000}
+
+
+async def time_handler(handler, make_update, contexts, viewers, iterations):
+    samples = []
+    for i in range(iterations):
+        viewer = viewers[i % len(viewers)]
+        update = make_update(viewer)
+        context = contexts[viewer]
+        started = time.perf_counter()
+        await handler(update, context)
+        samples.append(time.perf_counter() - started)
+    return percentiles(samples)
+
+
+async def bench_size(users, args, workdir, report):
+    data = generate_dataset(users, args.likes_per_user, args.blocks_per_user, args.matches_per_user)
+    path = os.path.join(workdir, f"db_{users}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+    file_size = os.path.getsize(path)
+    ids = [u['telegram_id'] for u in data['users']]
+    del data
+    gc.collect()
+
+    backend = JsonBackend(path, path + '.backup', path + '.journal', flush_interval=3600, flush_threshold=10 ** 9)
+    tracemalloc.start()
+    backend.load()
+    _, load_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    gc.collect()
+    started = time.perf_counter()
+    store = backend.load()
+    load_time = time.perf_counter() - started
+
+    bot = StubBot()
+    writer = StoreWriter(store)
+    writer.start()
+    bot_data = {
+        'store': store,
+        'backend': backend,
+        'writer': writer,
+        'cards': main.CardCache(store, max_size=main.CARD_CACHE_SIZE),
+        'outbox': StubOutbox(),
+    }
+    rng = random.Random(7)
+    viewers = rng.sample(ids, min(len(ids), args.viewers))
+    contexts = {v: SimpleNamespace(bot=bot, bot_data=bot_data, user_data={}) for v in viewers}
+
+    results = {}
+    results['browse_profiles'] = await time_handler(
+        main.browse_profiles, lambda v: callback_update(bot, v, 'menu_browse'), contexts, viewers, args.iterations)
+    results['next_profile'] = await time_handler(
+        main.next_profile, lambda v: callback_update(bot, v, 'next'), contexts, viewers, args.iterations)
+    results['like_profile'] = await time_handler(
+        main.like_profile, lambda v: callback_update(bot, v, f"like_{rng.choice(ids)}"), contexts, viewers, args.iterations)
+    results['matches'] = await time_handler(
+        main.matches, lambda v: message_update(bot, v, '/matches'), contexts, viewers, args.iterations)
+    results['matches_page'] = await time_handler(
+        main.matches, lambda v: callback_update(bot, v, 'matches_page_1'), contexts, viewers, args.iterations)
+    results['likes'] = await time_handler(
+        main.likes_inbox, lambda v: message_update(bot, v, '/likes'), contexts, viewers, args.iterations)
+    results['likes_page'] = await time_handler(
+        main.likes_inbox, lambda v: callback_update(bot, v, 'likes_page_1'), contexts, viewers, args.iterations)
+    results['search'] = await time_handler(
+        main.search_query, lambda v: message_update(bot, v, ' '.join(rng.sample(BIO_WORDS, rng.randint(1, 2)))),
+        contexts, viewers, args.iterations)
+    for context in contexts.values():
+        context.user_data['browse_mode'] = 'album'
+    results['browse_album'] = await time_handler(
+        main.browse_profiles, lambda v: callback_update(bot, v, 'menu_browse'), contexts, viewers, args.iterations)
+    results['album_next'] = await time_handler(
+        main.next_album, lambda v: callback_update(bot, v, 'album_next'), contexts, viewers, args.iterations)
+    results['album_like'] = await time_handler(
+        main.like_from_album, lambda v: callback_update(bot, v, f"alike_{rng.choice(ids)}"), contexts, viewers, args.iterations)
+
+    started = time.perf_counter()
+    await backend.flush()
+    flush_time = time.perf_counter() - started
+    started = time.perf_counter()
+    await backend.compact()
+    save_time = time.perf_counter() - started
+    await writer.close()
+
+    report(f"== {users} users ({file_size / 1024 / 1024:.1f} MiB snapshot, {len(store.likes)} likes, "
+           f"{store.match_count()} matches, {len(store.blocked)} blocks)")
+    report(f"db load: {load_time:.3f}s, store memory peak {load_peak / 1024 / 1024:.1f} MiB; "
+           f"journal flush: {flush_time * 1000:.2f}ms; snapshot save: {save_time:.3f}s")
+    for name, stats in results.items():
+        report(f"  {name:<16} p50={stats['p50']:.3f}ms p90={stats['p90']:.3f}ms p99={stats['p99']:.3f}ms "
+               f"max={stats['max']:.3f}ms mean={stats['mean']:.3f}ms")
+    report(f"  bot calls: {dict(sorted(bot.calls.items()))}")
+    report(f"  process peak RSS so far: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB")
+
+
+async def run(args):
+    lines = []
+
+    def report(line):
+        print(line, flush=True)
+        lines.append(line)
+
+    report(f"bench run {time.strftime('%Y-%m-%d %H:%M:%S')} python {sys.version.split()[0]} "
+           f"iterations={args.iterations} viewers={args.viewers} likes/user={args.likes_per_user} "
+           f"blocks/user={args.blocks_per_user} matches/user={args.matches_per_user}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for users in args.sizes:
+            await bench_size(users, args, workdir, report)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    print(f"results written to {args.output}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Synthetic-load benchmark for the bot's handler hot paths.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help="dataset sizes in users (1000000 is supported but needs several GiB of RAM)")
+    parser.add_argument('--iterations', type=int, default=300)
+    parser.add_argument('--viewers', type=int, default=50)
+    parser.add_argument('--likes-per-user', type=float, default=10)
+    parser.add_argument('--blocks-per-user', type=float, default=0.5)
+    parser.add_argument('--matches-per-user', type=float, default=1)
+    parser.add_argument('--output', default='bench_output.txt')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    logging.disable(logging.INFO)
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,155 @@
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import bench
+import main
+from cluster import WorkerPool, receive_batch
+from storage import SqliteBackend, StoreWriter, migrate_json_to_sqlite
+
+
+def synthetic_updates(ids, viewers, per_viewer, seed=11):
+    rng = random.Random(seed)
+    updates = []
+    for step in range(per_viewer):
+        for viewer in viewers:
+            if step == 0:
+                data = 'menu_browse'
+            elif rng.random() < 0.3:
+                data = f"like_{rng.choice(ids)}"
+            else:
+                data = 'next'
+            updates.append({'update_id': len(updates) + 1,
+                            'callback_query': {'id': str(len(updates)), 'from': {'id': viewer}, 'data': data}})
+    return updates
+
+
+HANDLERS = [('like_', main.like_profile), ('next', main.next_profile), ('menu_browse', main.browse_profiles)]
+
+
+async def drive_worker(path, index, workers, updates, heartbeat):
+    backend = SqliteBackend(path, origin=index, flush_interval=0.5, flush_threshold=500)
+    store = backend.load()
+    writer = StoreWriter(store)
+    writer.start()
+    backend.start()
+    bot = bench.StubBot()
+    bot_data = {
+        'store': store,
+        'backend': backend,
+        'writer': writer,
+        'cards': main.CardCache(store, max_size=main.CARD_CACHE_SIZE),
+        'outbox': bench.StubOutbox(),
+        'worker_index': index,
+        'workers': workers,
+    }
+    application = SimpleNamespace(bot_data=bot_data)
+    contexts = {}
+    processed = 0
+    last_sync = time.monotonic()
+    loop = asyncio.get_running_loop()
+    while True:
+        heartbeat.value = time.time()
+        batch = await loop.run_in_executor(None, receive_batch, updates)
+        if batch and batch[-1] is None:
+            batch.pop()
+            stopping = True
+        else:
+            stopping = False
+        for data in batch:
+            query = data['callback_query']
+            user_id = query['from']['id']
+            context = contexts.get(user_id)
+            if context is None:
+                context = contexts[user_id] = SimpleNamespace(bot=bot, bot_data=bot_data, user_data={})
+            handler = next(h for prefix, h in HANDLERS if query['data'].startswith(prefix))
+            await handler(bench.callback_update(bot, user_id, query['data']), context)
+            processed += 1
+        if time.monotonic() - last_sync >= main.CLUSTER_SYNC_INTERVAL:
+            last_sync = time.monotonic()
+            await main.sync_cluster(application)
+        if stopping:
+            break
+    await writer.close()
+    await backend.close()
+    print(f"  worker {index}: {processed} updates, {backend.remote_events} remote events applied", flush=True)
+
+
+def bench_worker(path, index, workers, updates, heartbeat):
+    logging.disable(logging.INFO)
+    asyncio.run(drive_worker(path, index, workers, updates, heartbeat))
+
+
+def run_pool(path, workers, updates):
+    pool = WorkerPool(functools.partial(bench_worker, path), workers, startup_timeout=600)
+    pool.start()
+    while not all(beat.value for beat in pool.heartbeats):
+        time.sleep(0.05)
+    started = time.perf_counter()
+    for data in updates:
+        pool.dispatch(data)
+    pool.stop(timeout=600)
+    elapsed = time.perf_counter() - started
+    return elapsed, pool
+
+
+def run(args):
+    lines = []
+
+    def report(line):
+        print(line, flush=True)
+        lines.append(line)
+
+    report(f"cluster bench run {time.strftime('%Y-%m-%d %H:%M:%S')} python {sys.version.split()[0]} "
+           f"cpus={os.cpu_count()} users={args.users} viewers={args.viewers} updates/viewer={args.per_viewer}")
+    with tempfile.TemporaryDirectory() as workdir:
+        data = bench.generate_dataset(args.users, args.likes_per_user, args.blocks_per_user, args.matches_per_user)
+        json_path = os.path.join(workdir, 'db.json')
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        ids = [u['telegram_id'] for u in data['users']]
+        del data
+        template = os.path.join(workdir, 'template.sqlite3')
+        migrate_json_to_sqlite(json_path, template)
+        viewers = random.Random(7).sample(ids, min(len(ids), args.viewers))
+        updates = synthetic_updates(ids, viewers, args.per_viewer)
+        baseline = None
+        for workers in args.workers:
+            path = os.path.join(workdir, f"db_{workers}.sqlite3")
+            shutil.copyfile(template, path)
+            elapsed, pool = run_pool(path, workers, updates)
+            throughput = len(updates) / elapsed
+            baseline = baseline or throughput
+            report(f"== {workers} workers: {len(updates)} updates in {elapsed:.2f}s, {throughput:.0f} updates/s, "
+                   f"x{throughput / baseline:.2f} vs {args.workers[0]} workers, restarts {sum(pool.restarts)}, "
+                   f"per worker {pool.dispatched}")
+    with open(args.output, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    print(f"results written to {args.output}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Throughput benchmark for the sharded multi-process worker mode.")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--viewers', type=int, default=2000)
+    parser.add_argument('--per-viewer', type=int, default=10)
+    parser.add_argument('--likes-per-user', type=float, default=10)
+    parser.add_argument('--blocks-per-user', type=float, default=0.5)
+    parser.add_argument('--matches-per-user', type=float, default=1)
+    parser.add_argument('--output', default='bench_cluster_output.txt')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    logging.disable(logging.INFO)
+    run(parse_args())
@@ -0,0 +1,262 @@
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+import time
+import zlib
+
+from telegram import Update
+from telegram.error import TelegramError
+
+logger = logging.getLogger(__name__)
+
+
+def update_user_id(data):
+    chat_id = None
+    for value in data.values():
+        if not isinstance(value, dict):
+            continue
+        user = value.get('from') or value.get('user')
+        if isinstance(user, dict) and 'id' in user:
+            return user['id']
+        chat = value.get('chat') or (value.get('message') or {}).get('chat')
+        if chat_id is None and isinstance(chat, dict):
+            chat_id = chat.get('id')
+    return chat_id or 0
+
+
+def shard_for(user_id, workers):
+    return zlib.crc32(user_id.to_bytes(8, 'little', signed=True)) % workers
+
+
+class WorkerPool:
+    def __init__(self, target, workers, health_timeout=30.0, startup_timeout=300.0):
+        self.target = target
+        self.workers = workers
+        self.health_timeout = health_timeout
+        self.startup_timeout = startup_timeout
+        self._context = multiprocessing.get_context('spawn')
+        self.queues = [self._context.Queue() for _ in range(workers)]
+        self.heartbeats = [self._context.Value('d', 0.0, lock=False) for _ in range(workers)]
+        self.processes = [None] * workers
+        self.started = [0.0] * workers
+        self.restarts = [0] * workers
+        self.dispatched = [0] * workers
+        self._held = {}
+
+    def _spawn(self, index):
+        self.heartbeats[index].value = 0.0
+        process = self._context.Process(target=self.target, name=f"worker-{index}",
+                                        args=(index, self.workers, self.queues[index], self.heartbeats[index]))
+        process.start()
+        self.processes[index] = process
+        self.started[index] = time.time()
+        logger.info("Started worker %s/%s as pid %s", index, self.workers, process.pid)
+
+    def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+
+    def dispatch(self, data):
+        index = shard_for(update_user_id(data), self.workers)
+        held = self._held.get(index)
+        if held is not None:
+            held.append(data)
+        else:
+            self.queues[index].put(data)
+        self.dispatched[index] += 1
+
+    def _problem(self, index, now):
+        process = self.processes[index]
+        if not process.is_alive():
+            return f"exited with code {process.exitcode}"
+        beat = self.heartbeats[index].value
+        if not beat and now - self.started[index] > self.startup_timeout:
+            return f"did not finish starting in {self.startup_timeout:.0f}s"
+        if beat and now - beat > self.health_timeout:
+            return f"missed heartbeats for {now - beat:.0f}s"
+        return None
+
+    async def check(self):
+        now = time.time()
+        for index in range(self.workers):
+            problem = self._problem(index, now)
+            if problem is not None:
+                logger.error("Worker %s %s, restarting it", index, problem)
+                await self._restart(index)
+
+    async def _restart(self, index):
+        self._held[index] = []
+        try:
+            pending = await asyncio.get_running_loop().run_in_executor(None, self._reap, index)
+        except Exception as e:
+            logger.error("Could not drain the queue of worker %s: %s", index, e)
+            pending = []
+        held = self._held.pop(index)
+        fresh = self._context.Queue()
+        for data in pending + held:
+            fresh.put(data)
+        self.queues[index] = fresh
+        if pending:
+            logger.info("Moved %s queued updates to the restarted worker %s", len(pending), index)
+        self.restarts[index] += 1
+        self._spawn(index)
+
+    def _reap(self, index):
+        process, stale = self.processes[index], self.queues[index]
+        if process.is_alive():
+            process.kill()
+        process.join(5)
+        pending = []
+        while True:
+            try:
+                data = stale.get(timeout=0.1)
+            except queue.Empty:
+                break
+            if data is not None:
+                pending.append(data)
+        stale.close()
+        return pending
+
+    def healthy(self):
+        now = time.time()
+        return all(self.heartbeats[i].value and self._problem(i, now) is None for i in range(self.workers))
+
+    def status(self):
+        now = time.time()
+        return [{
+            'worker': index,
+            'pid': self.processes[index].pid,
+            'alive': self.processes[index].is_alive(),
+            'heartbeat_age': round(now - self.heartbeats[index].value, 1) if self.heartbeats[index].value else None,
+            'restarts': self.restarts[index],
+            'dispatched': self.dispatched[index],
+        } for index in range(self.workers)]
+
+    async def monitor(self, interval=1.0):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.check()
+            except Exception as e:
+                logger.error("Worker health check failed: %s", e)
+
+    def stop(self, timeout=30.0):
+        for updates in self.queues:
+            updates.put(None)
+        deadline = time.time() + timeout
+        for index, process in enumerate(self.processes):
+            if process is None:
+                continue
+            process.join(max(0.0, deadline - time.time()))
+            if process.is_alive():
+                logger.warning("Worker %s did not stop in %ss, terminating it", index, timeout)
+                process.terminate()
+                process.join(5)
+        logger.info("Worker pool stopped: %s", self.status())
+
+
+def _stop_on_signals(stop_event):
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, stop_event.set)
+        except NotImplementedError:
+            pass
+
+
+async def _poll_updates(bot, pool, timeout):
+    await bot.delete_webhook(drop_pending_updates=False)
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=timeout, read_timeout=timeout + 10,
+                                            allowed_updates=Update.ALL_TYPES)
+        except TelegramError as e:
+            logger.warning("Polling for updates failed: %s", e)
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            pool.dispatch(update.to_dict())
+            offset = update.update_id + 1
+
+
+async def serve_ingress(bot, pool, server=None, webhook_url=None, poll_timeout=30):
+    stop_event = asyncio.Event()
+    _stop_on_signals(stop_event)
+    pool.start()
+    await bot.initialize()
+    tasks = [asyncio.get_running_loop().create_task(pool.monitor())]
+    if server is not None:
+        await server.start()
+        if webhook_url:
+            await bot.set_webhook(url=webhook_url, secret_token=server.secret_token,
+                                  allowed_updates=Update.ALL_TYPES, drop_pending_updates=False)
+            logger.info("Registered webhook %s", webhook_url)
+    else:
+        tasks.append(asyncio.get_running_loop().create_task(_poll_updates(bot, pool, poll_timeout)))
+    logger.info("Ingress dispatching updates to %s workers", pool.workers)
+    try:
+        await stop_event.wait()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if server is not None:
+            await server.stop()
+        await bot.shutdown()
+        await asyncio.get_running_loop().run_in_executor(None, pool.stop)
+
+
+def receive_batch(updates, limit=256):
+    try:
+        batch = [updates.get(timeout=1)]
+    except queue.Empty:
+        return []
+    while batch[-1] is not None and len(batch) < limit:
+        try:
+            batch.append(updates.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+
+async def serve_worker(application, updates, heartbeat, on_start=None, on_stop=None, on_tick=None, tick_interval=0.5):
+    stop_event = asyncio.Event()
+    _stop_on_signals(stop_event)
+    loop = asyncio.get_running_loop()
+
+    async def pump():
+        while True:
+            for data in await loop.run_in_executor(None, receive_batch, updates):
+                if data is None:
+                    stop_event.set()
+                    return
+                await application.update_queue.put(Update.de_json(data, application.bot))
+
+    async def tick():
+        while True:
+            heartbeat.value = time.time()
+            if on_tick is not None:
+                try:
+                    await on_tick(application)
+                except Exception as e:
+                    logger.error("Worker tick failed: %s", e)
+            await asyncio.sleep(tick_interval)
+
+    await application.initialize()
+    if on_start is not None:
+        await on_start(application)
+    await application.start()
+    tasks = [loop.create_task(pump()), loop.create_task(tick())]
+    try:
+        await stop_event.wait()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await application.stop()
+        if on_stop is not None:
+            await on_stop(application)
+        await application.shutdown()
@@ -0,0 +1,81 @@
+import atexit
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+def parse_level(value):
+    level = logging.getLevelName(value.upper())
+    if not isinstance(level, int):
+        raise ValueError(value)
+    return level
+
+
+def parse_mapping(spec, convert):
+    mapping = {}
+    for item in (spec or '').split(','):
+        name, sep, value = item.strip().partition('=')
+        if not sep:
+            continue
+        try:
+            mapping[name.strip()] = convert(value.strip())
+        except ValueError:
+            logging.getLogger(__name__).warning("Ignoring bad logging setting %r", item)
+    return mapping
+
+
+class DeferredQueueHandler(QueueHandler):
+    def prepare(self, record):
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+        self._every = {}
+        self._seen = {}
+
+    def _interval(self, name):
+        every = self._every.get(name)
+        if every is None:
+            rate, logger_name = None, name
+            while rate is None and logger_name:
+                rate = self.rates.get(logger_name)
+                logger_name = logger_name.rpartition('.')[0]
+            every = self._every[name] = 1 if rate is None or rate >= 1 else (0 if rate <= 0 else round(1 / rate))
+        return every
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        every = self._interval(record.name)
+        if every == 1:
+            return True
+        if every == 0:
+            return False
+        key = (record.name, record.msg)
+        seen = self._seen.get(key, 0)
+        self._seen[key] = seen + 1
+        return seen % every == 0
+
+
+def setup_logging(level='INFO', module_levels='', sample_rates=''):
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(parse_mapping(sample_rates, float)))
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(level)
+    for name, module_level in parse_mapping(module_levels, parse_level).items():
+        logging.getLogger(name).setLevel(module_level)
+
+    listener = QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
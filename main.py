@@ -1,16 +1,31 @@
-import json
+import asyncio
 import logging
 import os
-import shutil
+import sys
+import time
+from array import array
+from collections import OrderedDict
 import dotenv
 from dotenv import load_dotenv
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
+from logsetup import setup_logging
+from storage import JsonBackend, SqliteBackend, StoreWriter, migrate_json_to_sqlite
+from metrics import InstrumentedRequest, Metrics
+from moderation import ReportDigest
+from outbox import Outbox
+from persistence import SessionEvictor, SessionPersistence
+import ranking
+from ranking import rank_candidates
+from webhook import WebhookServer, serve_webhook
+from cluster import WorkerPool, serve_ingress, serve_worker
+from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
 from telegram.ext import (
     Application,
+    BaseUpdateProcessor,
     CommandHandler,
     CallbackQueryHandler,
     ConversationHandler,
     MessageHandler,
+    TypeHandler,
     filters,
     ContextTypes,
 )
@@ -20,95 +35,201 @@ load_dotenv()
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 ADMIN_CHAT_ID = os.getenv('ADMIN_CHAT_ID')
 
-logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_LEVELS = os.getenv('LOG_LEVELS', 'httpx=WARNING')
+LOG_SAMPLE = os.getenv('LOG_SAMPLE', '')
+
+setup_logging(LOG_LEVEL, LOG_LEVELS, LOG_SAMPLE)
 logger = logging.getLogger(__name__)
+update_logger = logging.getLogger('updates')
 
 print(f"Loaded BOT_TOKEN: {BOT_TOKEN}")
 
 DB_FILE = '/home/venikpes/T4t/db.json'
 DB_BACKUP_FILE = '/home/venikpes/T4t/db_backup.json'
 DB_RESTORE_FILE = '/home/venikpes/T4t/db_restore.json'
+DB_JOURNAL_FILE = '/home/venikpes/T4t/db_journal.jsonl'
+DB_SQLITE_FILE = '/home/venikpes/T4t/db.sqlite3'
+SESSION_FILE = '/home/venikpes/T4t/sessions.sqlite3'
+METRICS_FILE = '/home/venikpes/T4t/metrics.prom'
+
+DB_BACKEND = os.getenv('DB_BACKEND', 'json').lower()
+DB_RESTORE_UNTIL = float(os.getenv('DB_RESTORE_UNTIL')) if os.getenv('DB_RESTORE_UNTIL') else None
+DB_JOURNAL_COMPACT_BYTES = int(os.getenv('DB_JOURNAL_COMPACT_BYTES', str(4 * 1024 * 1024)))
+DB_FLUSH_INTERVAL = float(os.getenv('DB_FLUSH_INTERVAL', '2'))
+DB_FLUSH_THRESHOLD = int(os.getenv('DB_FLUSH_THRESHOLD', '100'))
+DB_BACKUP_INTERVAL = float(os.getenv('DB_BACKUP_INTERVAL', '3600'))
+# Point-in-time restore reaches back DB_BACKUP_GENERATIONS compactions (one per DB_BACKUP_INTERVAL or
+# DB_JOURNAL_COMPACT_BYTES of journal, whichever comes first): about a day of history with the defaults.
+DB_BACKUP_GENERATIONS = int(os.getenv('DB_BACKUP_GENERATIONS', '24'))
+
+CARD_CACHE_SIZE = int(os.getenv('CARD_CACHE_SIZE', '10000'))
+RANK_TOP_K = int(os.getenv('RANK_TOP_K', '200'))
+MATCHES_PAGE_SIZE = int(os.getenv('MATCHES_PAGE_SIZE', '10'))
+LIKES_PAGE_SIZE = int(os.getenv('LIKES_PAGE_SIZE', '5'))
+ALBUM_SIZE = min(max(int(os.getenv('ALBUM_SIZE', '5')), 2), 10)
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '64'))
+
+OUTBOX_GLOBAL_RATE = float(os.getenv('OUTBOX_GLOBAL_RATE', '25'))
+OUTBOX_PER_CHAT_RATE = float(os.getenv('OUTBOX_PER_CHAT_RATE', '1'))
+OUTBOX_CONCURRENCY = int(os.getenv('OUTBOX_CONCURRENCY', '8'))
+
+SESSION_MAX_IDLE = float(os.getenv('SESSION_MAX_IDLE', str(7 * 24 * 3600)))
+SESSION_UPDATE_INTERVAL = float(os.getenv('SESSION_UPDATE_INTERVAL', '10'))
+SESSION_TTL = float(os.getenv('SESSION_TTL', str(6 * 3600)))
+SESSION_MAX_BYTES = int(os.getenv('SESSION_MAX_BYTES', str(256 * 1024 * 1024)))
+SESSION_EVICT_INTERVAL = float(os.getenv('SESSION_EVICT_INTERVAL', '300'))
+CONVERSATION_TIMEOUT = float(os.getenv('CONVERSATION_TIMEOUT', '1800'))
+
+REPORT_DIGEST_INTERVAL = float(os.getenv('REPORT_DIGEST_INTERVAL', '0'))
+REPORT_ALERT_THRESHOLD = int(os.getenv('REPORT_ALERT_THRESHOLD', '5'))
+
+METRICS_INTERVAL = float(os.getenv('METRICS_INTERVAL', '15'))
+GC_INTERVAL = float(os.getenv('GC_INTERVAL', '3600'))
+
+BOT_MODE = os.getenv('BOT_MODE', 'polling').lower()
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'webhook')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN')
+WEBHOOK_WAIT_FOR_HANDLERS = os.getenv('WEBHOOK_WAIT_FOR_HANDLERS', '0') == '1'
+
+CLUSTER_WORKERS = int(os.getenv('CLUSTER_WORKERS', '0'))
+CLUSTER_SYNC_INTERVAL = float(os.getenv('CLUSTER_SYNC_INTERVAL', '0.5'))
+CLUSTER_HEALTH_TIMEOUT = float(os.getenv('CLUSTER_HEALTH_TIMEOUT', '30'))
+CLUSTER_EVENT_RETENTION = float(os.getenv('CLUSTER_EVENT_RETENTION', '3600'))
+
+REGISTER, GET_NAME, GET_AGE, GET_GENDER, GET_GENDER_OTHER, GET_PHOTO, GET_BIO, EDIT_PROFILE, EDIT_NAME, EDIT_AGE, EDIT_GENDER, EDIT_GENDER_OTHER, EDIT_CITY, EDIT_PHOTO, EDIT_BIO, REPORT, GET_REPORT_REASON, GET_REPORT_SCREENSHOT, FEEDBACK, GET_FEEDBACK_MESSAGE, GET_FEEDBACK_CONTACT, SEARCH_QUERY = range(22)
+
+def create_backend(origin=None):
+    options = dict(flush_interval=DB_FLUSH_INTERVAL, flush_threshold=DB_FLUSH_THRESHOLD)
+    if DB_BACKEND == 'sqlite':
+        return SqliteBackend(DB_SQLITE_FILE, origin=origin, event_retention=CLUSTER_EVENT_RETENTION, **options)
+    return JsonBackend(
+        DB_FILE,
+        DB_BACKUP_FILE,
+        DB_JOURNAL_FILE,
+        restore_path=DB_RESTORE_FILE,
+        restore_until=DB_RESTORE_UNTIL,
+        backup_interval=DB_BACKUP_INTERVAL,
+        compact_bytes=DB_JOURNAL_COMPACT_BYTES,
+        generations=DB_BACKUP_GENERATIONS,
+        **options
+    )
 
-REGISTER, GET_NAME, GET_AGE, GET_GENDER, GET_GENDER_OTHER, GET_PHOTO, GET_BIO, EDIT_PROFILE, EDIT_NAME, EDIT_AGE, EDIT_GENDER, EDIT_GENDER_OTHER, EDIT_CITY, EDIT_PHOTO, EDIT_BIO, REPORT, GET_REPORT_REASON, GET_REPORT_SCREENSHOT, FEEDBACK, GET_FEEDBACK_MESSAGE, GET_FEEDBACK_CONTACT = range(21)
-
-def load_db():
-    if os.path.exists(DB_RESTORE_FILE):
-        logger.info(f"Restoration file {DB_RESTORE_FILE} found. Applying to {DB_FILE}")
-        try:
-            shutil.copyfile(DB_RESTORE_FILE, DB_FILE)
-            os.remove(DB_RESTORE_FILE)
-            logger.info(f"Restored {DB_FILE} from {DB_RESTORE_FILE}")
-        except Exception as e:
-            logger.error(f"Failed to restore database: {e}")
-            raise Exception(f"Database restoration failed: {e}")
-
-    if not os.path.exists(DB_FILE):
-        logger.warning(f"Database file {DB_FILE} not found. Initializing new database.")
-        default_db = {
-            "users": [],
-            "blocked": [],
-            "likes": [],
-            "matches": [],
-            "reports": [],
-            "feedback": []
-        }
-        with open(DB_FILE, 'w', encoding='utf-8') as f:
-            json.dump(default_db, f, ensure_ascii=False, indent=2)
-        return default_db
-
-    try:
-        with open(DB_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        logger.info(f"Successfully loaded database from {DB_FILE}")
-        logger.info(f"Number of users in database: {len(data['users'])}")
-        if len(data['users']) > 0:
-            logger.info(f"Sample user: {data['users'][0]}")
-        return data
-    except (json.JSONDecodeError, IOError) as e:
-        logger.error(f"Failed to load database from {DB_FILE}: {e}")
-        if os.path.exists(DB_BACKUP_FILE):
-            logger.info(f"Attempting to load backup database from {DB_BACKUP_FILE}")
-            try:
-                with open(DB_BACKUP_FILE, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                logger.info(f"Successfully loaded backup database")
-                logger.info(f"Number of users in backup database: {len(data['users'])}")
-                with open(DB_FILE, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, ensure_ascii=False, indent=2)
-                return data
-            except (json.JSONDecodeError, IOError) as backup_e:
-                logger.error(f"Failed to load backup database: {backup_e}")
-        raise Exception(f"Database load failed: {e}. Backup also unavailable or corrupted.")
-
-def save_db(data):
-    if os.path.exists(DB_FILE):
-        try:
-            shutil.copyfile(DB_FILE, DB_BACKUP_FILE)
-            logger.info(f"Created backup of database at {DB_BACKUP_FILE}")
-        except Exception as e:
-            logger.error(f"Failed to create backup of database: {e}")
+MAIN_MENU = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📝 Регистрация", callback_data="menu_register"),
+     InlineKeyboardButton("🔍 Просмотр анкет", callback_data="menu_browse")],
+    [InlineKeyboardButton("💖 Мэтчи", callback_data="menu_matches"),
+     InlineKeyboardButton("📬 Мне поставили лайк", callback_data="menu_likes")],
+    [InlineKeyboardButton("👤 Мой профиль", callback_data="menu_profile"),
+     InlineKeyboardButton("🔎 Поиск по интересам", callback_data="menu_search")],
+    [InlineKeyboardButton("✏️ Редактировать профиль", callback_data="menu_edit_profile"),
+     InlineKeyboardButton("💬 Обратная связь", callback_data="menu_feedback")]
+])
 
-    try:
-        with open(DB_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        logger.info(f"Successfully saved database to {DB_FILE}")
-    except Exception as e:
-        logger.error(f"Failed to save database to {DB_FILE}: {e}")
-        raise Exception(f"Database save failed: {e}")
+NO_MORE_PROFILES = "Нет больше анкет для просмотра. Чтобы снова увидеть просмотренные анкеты, отправьте /reset_seen."
 
 def get_main_menu():
+    return MAIN_MENU
+
+def render_caption(profile):
+    return (
+        f"Имя: {profile['name']}\n"
+        f"Возраст: {profile['age']}\n"
+        f"Пол: {profile['gender']}\n"
+        f"Город: {profile['city'] or 'Не указан'}\n"
+        f"О себе: {profile['bio']}"
+    )
+
+def render_card(kind, profile):
+    if kind == 'own':
+        return f"Ваш профиль:\n{render_caption(profile)}", MAIN_MENU
+    if kind == 'album':
+        return render_caption(profile)[:1000], None
     keyboard = [
-        [InlineKeyboardButton("📝 Регистрация", callback_data="menu_register"),
-         InlineKeyboardButton("🔍 Просмотр анкет", callback_data="menu_browse")],
-        [InlineKeyboardButton("💖 Мэтчи", callback_data="menu_matches"),
-         InlineKeyboardButton("👤 Мой профиль", callback_data="menu_profile")],
-        [InlineKeyboardButton("✏️ Редактировать профиль", callback_data="menu_edit_profile"),
-         InlineKeyboardButton("💬 Обратная связь", callback_data="menu_feedback")]
+        [InlineKeyboardButton("👍 Лайк", callback_data=f"like_{profile['telegram_id']}")],
+        [InlineKeyboardButton("➡️ Следующая анкета", callback_data="next")],
+        [InlineKeyboardButton("⚠️ Пожаловаться", callback_data=f"report_{profile['telegram_id']}")],
+        [InlineKeyboardButton("⬅️ Главное меню", callback_data="back_to_menu")]
     ]
-    return InlineKeyboardMarkup(keyboard)
+    return render_caption(profile), InlineKeyboardMarkup(keyboard)
+
+class CardCache:
+    def __init__(self, store, max_size=10000):
+        self.store = store
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._cards = OrderedDict()
+
+    def get(self, kind, profile):
+        key = (kind, profile['telegram_id'])
+        version = self.store.user_version(profile['telegram_id'])
+        entry = self._cards.get(key)
+        if entry is not None and entry[0] == version:
+            self._cards.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        card = render_card(kind, profile)
+        self._cards[key] = (version, card)
+        self._cards.move_to_end(key)
+        if len(self._cards) > self.max_size:
+            self._cards.popitem(last=False)
+        return card
+
+    def invalidate(self, telegram_id):
+        self._cards.pop(('own', telegram_id), None)
+        self._cards.pop(('browse', telegram_id), None)
+        self._cards.pop(('album', telegram_id), None)
+
+def get_writer(context):
+    return context.bot_data['writer']
+
+def get_outbox(context):
+    return context.bot_data['outbox']
+
+def get_cards(context):
+    return context.bot_data['cards']
+
+def get_store(context):
+    return context.bot_data['store']
+
+def runtime_gauges(bot_data):
+    store = bot_data['store']
+    yield 'users', store.user_count(), {}
+    yield 'likes', len(store.likes), {}
+    yield 'matches', store.match_count(), {}
+    yield 'reports', len(store.reports), {}
+    yield 'store_revision', store.revision, {}
+    yield 'writer_queue_depth', bot_data['writer'].queue_depth, {}
+    yield 'db_buffered_events', bot_data['backend'].buffered, {}
+    cards = bot_data['cards']
+    yield 'card_cache', cards.hits, {'result': 'hit'}
+    yield 'card_cache', cards.misses, {'result': 'miss'}
+    if 'outbox' in bot_data:
+        for key, value in bot_data['outbox'].stats().items():
+            yield 'outbox', value, {'stat': key}
+    if 'report_digest' in bot_data:
+        yield 'reports_pending_digest', bot_data['report_digest'].pending_reports, {}
+    if bot_data.get('worker_index') is not None:
+        yield 'cluster_remote_events', bot_data['backend'].remote_events, {}
+    if 'sessions' in bot_data:
+        sessions = bot_data['sessions']
+        yield 'sessions_in_memory', sessions.sessions, {}
+        yield 'session_bytes', sessions.bytes, {}
+        for reason, count in sessions.evicted.items():
+            yield 'sessions_evicted', count, {'reason': reason}
+            yield 'session_bytes_evicted', sessions.evicted_bytes[reason], {'reason': reason}
+
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    logger.info("Received /stats from admin chat, user: %s", update.effective_user.id)
+    await update.message.reply_text(context.bot_data['metrics'].summary()[:4096])
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    logger.info(f"Received /start from user: {update.effective_user.id}")
+    update_logger.info("Received /start from user: %s", update.effective_user.id)
     rules = (
         "Добро пожаловать в T4t Meet!\n\n"
         "Подпишитесь на наш канал: https://t.me/tperehod\n"
@@ -126,28 +247,31 @@ async def menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     command = query.data
-    logger.info(f"Menu button clicked by user {query.from_user.id}: {command}")
+    update_logger.info("Menu button clicked by user %s: %s", query.from_user.id, command)
 
     if command == "menu_register":
-        logger.info("Routing to register_start")
+        logger.debug("Routing to register_start")
         return await register_start(update, context)
     elif command == "menu_browse":
-        logger.info("Routing to browse_profiles")
+        logger.debug("Routing to browse_profiles")
         return await browse_profiles(update, context)
     elif command == "menu_matches":
-        logger.info("Routing to matches")
+        logger.debug("Routing to matches")
         return await matches(update, context)
+    elif command == "menu_likes":
+        logger.debug("Routing to likes_inbox")
+        return await likes_inbox(update, context)
     elif command == "menu_profile":
-        logger.info("Routing to profile")
+        logger.debug("Routing to profile")
         return await profile(update, context)
     elif command == "menu_edit_profile":
-        logger.info("Routing to edit_profile")
+        logger.debug("Routing to edit_profile")
         return await edit_profile(update, context)
     elif command == "menu_feedback":
-        logger.info("Routing to feedback_start")
+        logger.debug("Routing to feedback_start")
         return await feedback_start(update, context)
     else:
-        logger.warning(f"Unknown menu command: {command}")
+        logger.warning("Unknown menu command: %s", command)
         await query.message.reply_text("Неизвестная команда.", reply_markup=get_main_menu())
 
 async def register_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -159,34 +283,38 @@ async def register_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         chat_id = update.message.chat_id
 
-    logger.info(f"Received /register from user: {update.effective_user.id}")
-    db = load_db()
-    if any(u['telegram_id'] == update.effective_user.id for u in db['users']):
+    logger.info("Received /register from user: %s", update.effective_user.id)
+    store = get_store(context)
+    if store.has_user(update.effective_user.id):
         await context.bot.send_message(chat_id, "Вы уже зарегистрированы! Используйте 'Мой профиль' или 'Редактировать профиль'.", reply_markup=get_main_menu())
         return ConversationHandler.END
+    if store.is_banned(update.effective_user.id):
+        logger.info("Refused registration of banned user %s", update.effective_user.id)
+        await context.bot.send_message(chat_id, "Ваш аккаунт заблокирован администратором.")
+        return ConversationHandler.END
     await context.bot.send_message(chat_id, "Ваше имя: как вас будут видеть другие пользователи?", reply_markup=ReplyKeyboardRemove())
     return GET_NAME
 
 async def get_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    logger.info(f"Received text message for name input from user {user_id}: {update.message.text}")
+    logger.info("Received text message for name input from user %s: %s", user_id, update.message.text)
     if not update.message.text:
-        logger.warning(f"No text received from user {user_id} for name input")
+        logger.warning("No text received from user %s for name input", user_id)
         await update.message.reply_text("Пожалуйста, введите ваше имя текстом.")
         return GET_NAME
     context.user_data['name'] = update.message.text
-    logger.info(f"Stored name for user {user_id}: {context.user_data['name']}")
+    logger.info("Stored name for user %s: %s", user_id, context.user_data['name'])
     await update.message.reply_text(f"Отлично, ваше имя будет '{context.user_data['name']}'. Теперь скажите, сколько вам лет?")
     return GET_AGE
 
 async def get_age(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    logger.info(f"Received text message for age input from user {user_id}: {update.message.text}")
+    logger.info("Received text message for age input from user %s: %s", user_id, update.message.text)
     try:
         age = int(update.message.text)
         if 16 <= age <= 100:
             context.user_data['age'] = age
-            logger.info(f"Stored age for user {user_id}: {age}")
+            logger.info("Stored age for user %s: %s", user_id, age)
             keyboard = [["Транс-женщина"], ["Транс-мужчина"], ["Небинарная персона"], ["Другое"]]
             reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
             await update.message.reply_text("Кем вы себя идентифицируете?", reply_markup=reply_markup)
@@ -201,7 +329,7 @@ async def get_age(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def get_gender(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     gender = update.message.text
-    logger.info(f"Received gender selection from user {user_id}: {gender}")
+    logger.info("Received gender selection from user %s: %s", user_id, gender)
     context.user_data['gender'] = gender
     if gender == "Другое":
         await update.message.reply_text("Пожалуйста, уточните вашу гендерную идентичность.")
@@ -212,7 +340,7 @@ async def get_gender(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def get_gender_other(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     gender = update.message.text
-    logger.info(f"Received custom gender from user {user_id}: {gender}")
+    logger.info("Received custom gender from user %s: %s", user_id, gender)
     context.user_data['gender'] = gender
     await update.message.reply_text("Введите ваш город (или 'Any' для всех городов):")
     return GET_PHOTO
@@ -220,7 +348,7 @@ async def get_gender_other(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def get_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     city = update.message.text.strip()
-    logger.info(f"Received city from user {user_id}: {city}")
+    logger.info("Received city from user %s: %s", user_id, city)
     context.user_data['city'] = city if city.lower() != 'any' else None
     await update.message.reply_text("Пожалуйста, загрузите вашу фотографию профиля.")
     return GET_BIO
@@ -228,19 +356,19 @@ async def get_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def get_bio(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     if update.message.photo:
-        logger.info(f"Received photo from user {user_id}")
+        logger.info("Received photo from user %s", user_id)
         context.user_data['photo_id'] = update.message.photo[-1].file_id
         await update.message.reply_text("Отлично, фото получено. Теперь расскажите немного о себе (ваши интересы, что вы ищете и т.д.).")
         return REGISTER
     else:
-        logger.warning(f"No photo received from user {user_id}")
+        logger.warning("No photo received from user %s", user_id)
         await update.message.reply_text("Пожалуйста, отправьте фотографию.")
         return GET_BIO
 
 async def complete_registration(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    logger.info(f"Completing registration for user {user.id}")
-    db = load_db()
+    logger.info("Completing registration for user %s", user.id)
+    store = get_store(context)
     profile = {
         'telegram_id': user.id,
         'username': user.username or f"user_{user.id}",
@@ -251,8 +379,7 @@ async def complete_registration(update: Update, context: ContextTypes.DEFAULT_TY
         'bio': update.message.text,
         'photo_id': context.user_data['photo_id']
     }
-    db['users'].append(profile)
-    save_db(db)
+    await get_writer(context).submit(store.add_user, profile)
     await update.message.reply_text("Спасибо за регистрацию! Ваш профиль создан.", reply_markup=get_main_menu())
     context.user_data.clear()
     return ConversationHandler.END
@@ -267,27 +394,19 @@ async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat_id = update.message.chat_id
 
     user_id = update.effective_user.id
-    logger.info(f"Showing profile for user: {user_id}")
-    db = load_db()
-    user_profile = next((u for u in db['users'] if u['telegram_id'] == user_id), None)
+    update_logger.info("Showing profile for user: %s", user_id)
+    store = get_store(context)
+    user_profile = store.get_user(user_id)
     if not user_profile:
-        logger.info(f"Profile not found for user {user_id}")
+        logger.info("Profile not found for user %s", user_id)
         await context.bot.send_message(chat_id, "Ваш профиль не найден. Пожалуйста, зарегистрируйтесь.", reply_markup=get_main_menu())
         return
-    logger.info(f"Found profile for user {user_id}: {user_profile}")
-    caption = (
-        f"Ваш профиль:\n"
-        f"Имя: {user_profile['name']}\n"
-        f"Возраст: {user_profile['age']}\n"
-        f"Пол: {user_profile['gender']}\n"
-        f"Город: {user_profile['city'] or 'Не указан'}\n"
-        f"О себе: {user_profile['bio']}"
-    )
+    caption, reply_markup = get_cards(context).get('own', user_profile)
     await context.bot.send_photo(
         chat_id=chat_id,
         photo=user_profile['photo_id'],
         caption=caption,
-        reply_markup=get_main_menu()
+        reply_markup=reply_markup
     )
 
 async def edit_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -300,7 +419,7 @@ async def edit_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         message = update.message
 
-    logger.info(f"Received edit_profile from user: {update.effective_user.id}")
+    logger.info("Received edit_profile from user: %s", update.effective_user.id)
     keyboard = [
         ["Изменить имя"],
         ["Изменить возраст"],
@@ -321,12 +440,9 @@ async def edit_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def update_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     new_name = update.message.text
     user_id = update.effective_user.id
-    db = load_db()
-    for user in db['users']:
-        if user['telegram_id'] == user_id:
-            user['name'] = new_name
-            break
-    save_db(db)
+    store = get_store(context)
+    await get_writer(context).submit(store.update_user, user_id, name=new_name)
+    get_cards(context).invalidate(user_id)
     await update.message.reply_text(f"Ваше имя обновлено на '{new_name}'.", reply_markup=get_main_menu())
     return ConversationHandler.END
 
@@ -339,12 +455,9 @@ async def update_age(update: Update, context: ContextTypes.DEFAULT_TYPE):
         new_age = int(update.message.text)
         if 16 <= new_age <= 100:
             user_id = update.effective_user.id
-            db = load_db()
-            for user in db['users']:
-                if user['telegram_id'] == user_id:
-                    user['age'] = new_age
-                    break
-            save_db(db)
+            store = get_store(context)
+            await get_writer(context).submit(store.update_user, user_id, age=new_age)
+            get_cards(context).invalidate(user_id)
             await update.message.reply_text(f"Ваш возраст обновлен на '{new_age}'.", reply_markup=get_main_menu())
             return ConversationHandler.END
         else:
@@ -366,24 +479,18 @@ async def update_gender(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Пожалуйста, уточните вашу гендерную идентичность.")
         return EDIT_GENDER_OTHER
     user_id = update.effective_user.id
-    db = load_db()
-    for user in db['users']:
-        if user['telegram_id'] == user_id:
-            user['gender'] = new_gender
-            break
-    save_db(db)
+    store = get_store(context)
+    await get_writer(context).submit(store.update_user, user_id, gender=new_gender)
+    get_cards(context).invalidate(user_id)
     await update.message.reply_text(f"Ваш пол обновлен на '{new_gender}'.", reply_markup=get_main_menu())
     return ConversationHandler.END
 
 async def edit_gender_other(update: Update, context: ContextTypes.DEFAULT_TYPE):
     new_gender = update.message.text
     user_id = update.effective_user.id
-    db = load_db()
-    for user in db['users']:
-        if user['telegram_id'] == user_id:
-            user['gender'] = new_gender
-            break
-    save_db(db)
+    store = get_store(context)
+    await get_writer(context).submit(store.update_user, user_id, gender=new_gender)
+    get_cards(context).invalidate(user_id)
     await update.message.reply_text(f"Ваш пол обновлен на '{new_gender}'.", reply_markup=get_main_menu())
     return ConversationHandler.END
 
@@ -394,12 +501,9 @@ async def edit_city(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def update_city(update: Update, context: ContextTypes.DEFAULT_TYPE):
     new_city = update.message.text.strip()
     user_id = update.effective_user.id
-    db = load_db()
-    for user in db['users']:
-        if user['telegram_id'] == user_id:
-            user['city'] = new_city if new_city.lower() != 'any' else None
-            break
-    save_db(db)
+    store = get_store(context)
+    await get_writer(context).submit(store.update_user, user_id, city=new_city if new_city.lower() != 'any' else None)
+    get_cards(context).invalidate(user_id)
     await update.message.reply_text(f"Ваш город обновлен на '{new_city or 'Не указан'}'.", reply_markup=get_main_menu())
     return ConversationHandler.END
 
@@ -411,12 +515,9 @@ async def update_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message.photo:
         new_photo_id = update.message.photo[-1].file_id
         user_id = update.effective_user.id
-        db = load_db()
-        for user in db['users']:
-            if user['telegram_id'] == user_id:
-                user['photo_id'] = new_photo_id
-                break
-        save_db(db)
+        store = get_store(context)
+        await get_writer(context).submit(store.update_user, user_id, photo_id=new_photo_id)
+        get_cards(context).invalidate(user_id)
         await update.message.reply_text("Ваша фотография профиля обновлена.", reply_markup=get_main_menu())
         return ConversationHandler.END
     else:
@@ -430,12 +531,9 @@ async def edit_bio(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def update_bio(update: Update, context: ContextTypes.DEFAULT_TYPE):
     new_bio = update.message.text
     user_id = update.effective_user.id
-    db = load_db()
-    for user in db['users']:
-        if user['telegram_id'] == user_id:
-            user['bio'] = new_bio
-            break
-    save_db(db)
+    store = get_store(context)
+    await get_writer(context).submit(store.update_user, user_id, bio=new_bio)
+    get_cards(context).invalidate(user_id)
     await update.message.reply_text("Ваше описание профиля обновлено.", reply_markup=get_main_menu())
     return ConversationHandler.END
 
@@ -453,68 +551,189 @@ async def browse_profiles(update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat_id = update.message.chat_id
 
     user_id = update.effective_user.id
-    logger.info(f"Received browse_profiles from user: {user_id}")
-    db = load_db()
-    logger.info(f"Total users in database: {len(db['users'])}")
-    user_profile = next((u for u in db['users'] if u['telegram_id'] == user_id), None)
+    update_logger.info("Received browse_profiles from user: %s", user_id)
+    store = get_store(context)
+    user_profile = store.get_user(user_id)
     if not user_profile:
-        logger.info(f"User {user_id} not registered")
+        logger.info("User %s not registered", user_id)
         await context.bot.send_message(chat_id, "Пожалуйста, зарегистрируйтесь.", reply_markup=get_main_menu())
         return
-    logger.info(f"User profile: {user_profile}")
-    blocked_ids = [b['blocked_id'] for b in db['blocked'] if b['blocker_id'] == user_id]
-    logger.info(f"Blocked IDs for user {user_id}: {blocked_ids}")
-    profiles = [u for u in db['users'] if u['telegram_id'] != user_id and u['telegram_id'] not in blocked_ids]
-    logger.info(f"Profiles after filtering self and blocked: {len(profiles)}")
-    if user_profile['age'] < 18:
-        profiles = [u for u in profiles if u['age'] < 18]
-        logger.info(f"Profiles after age filter (<18): {len(profiles)}")
+    candidate_ids = rank_candidates(store, user_id, store.candidates(user_id), limit=RANK_TOP_K)
+    update_logger.info("User %s has %s candidates out of %s users after age, city and blocked filters",
+                       user_id, len(candidate_ids), store.user_count())
+    if not candidate_ids:
+        text = NO_MORE_PROFILES if store.seen_count(user_id) else "Пока нет доступных анкет для просмотра."
+        await context.bot.send_message(chat_id, text, reply_markup=get_main_menu())
+        return
+    context.user_data['browse'] = {'ids': array('q', candidate_ids), 'pos': 0}
+    if context.user_data.get('browse_mode') == 'album':
+        await show_album(update, context)
     else:
-        profiles = [u for u in profiles if u['age'] >= 18]
-        logger.info(f"Profiles after age filter (>=18): {len(profiles)}")
-    if user_profile['city']:
-        profiles = [u for u in profiles if u['city'] == user_profile['city'] or u['city'] is None]
-        logger.info(f"Profiles after city filter ({user_profile['city']}): {len(profiles)}")
-    if not profiles:
-        logger.info("No profiles available to browse after all filters")
-        await context.bot.send_message(chat_id, "Пока нет доступных анкет для просмотра.", reply_markup=get_main_menu())
+        await show_profile(update, context)
+
+async def search_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    prompt = "Напишите ключевые слова для поиска по описанию и полу, например: музыка походы."
+    if update.callback_query:
+        query = update.callback_query
+        await query.answer()
+        chat_id = query.message.chat_id
+        await context.bot.delete_message(chat_id=chat_id, message_id=query.message.message_id)
+        await context.bot.send_message(chat_id, prompt)
+        return SEARCH_QUERY
+    if context.args:
+        await run_search(update, context, ' '.join(context.args))
+        return ConversationHandler.END
+    await update.message.reply_text(prompt)
+    return SEARCH_QUERY
+
+async def search_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await run_search(update, context, update.message.text)
+    return ConversationHandler.END
+
+async def run_search(update, context, text):
+    user_id = update.effective_user.id
+    store = get_store(context)
+    if not store.has_user(user_id):
+        await update.message.reply_text("Пожалуйста, зарегистрируйтесь.", reply_markup=get_main_menu())
+        return
+    started = time.perf_counter()
+    found = store.search(user_id, text)
+    update_logger.info("User %s searched %r: %s profiles in %.2fms",
+                       user_id, text, len(found), (time.perf_counter() - started) * 1000)
+    if not found:
+        await update.message.reply_text(f"По запросу «{text[:100]}» ничего не найдено.", reply_markup=get_main_menu())
         return
-    logger.info(f"Available profiles to browse: {profiles}")
-    context.user_data['profiles'] = profiles
-    context.user_data['current_profile'] = 0
+    context.user_data['browse'] = {'ids': array('q', found), 'pos': 0, 'query': text}
+    await update.message.reply_text(f"Найдено анкет: {len(found)}")
     await show_profile(update, context)
 
+def current_browse_profile(context, store, viewer_id):
+    browse = context.user_data.get('browse')
+    if not browse:
+        return None
+    ids = browse['ids']
+    while browse['pos'] < len(ids):
+        candidate_id = ids[browse['pos']]
+        profile = store.get_user(candidate_id)
+        if profile and not store.is_blocked(viewer_id, candidate_id) \
+                and ('query' in browse or not already_seen(store, viewer_id, candidate_id)):
+            return profile
+        browse['pos'] += 1
+    return None
+
+def already_seen(store, viewer_id, candidate_id):
+    return store.has_seen(viewer_id, candidate_id) or store.has_like(viewer_id, candidate_id)
+
 async def show_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message:
         chat_id = update.message.chat_id
     else:
         chat_id = update.callback_query.message.chat_id
 
-    profiles = context.user_data.get('profiles', [])
-    index = context.user_data.get('current_profile', 0)
-    if not profiles or index >= len(profiles):
+    store = get_store(context)
+    profile = current_browse_profile(context, store, update.effective_user.id)
+    if not profile:
         logger.info("No more profiles to display")
-        await context.bot.send_message(chat_id, "Нет больше анкет для просмотра.", reply_markup=get_main_menu())
+        await context.bot.send_message(chat_id, NO_MORE_PROFILES, reply_markup=get_main_menu())
         return
-    profile = profiles[index]
-    logger.info(f"Displaying profile for user: {profile['telegram_id']}")
-    keyboard = [
-        [InlineKeyboardButton("👍 Лайк", callback_data=f"like_{profile['telegram_id']}")],
-        [InlineKeyboardButton("➡️ Следующая анкета", callback_data="next")],
-        [InlineKeyboardButton("⚠️ Пожаловаться", callback_data=f"report_{profile['telegram_id']}")],
-        [InlineKeyboardButton("⬅️ Главное меню", callback_data="back_to_menu")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    update_logger.info("Displaying profile for user: %s", profile['telegram_id'])
+    caption, reply_markup = get_cards(context).get('browse', profile)
     try:
         await context.bot.send_photo(
             chat_id=chat_id,
             photo=profile['photo_id'],
-            caption=f"Имя: {profile['name']}\nВозраст: {profile['age']}\nПол: {profile['gender']}\nГород: {profile['city'] or 'Не указан'}\nО себе: {profile['bio']}",
+            caption=caption,
             reply_markup=reply_markup
         )
     except Exception as e:
-        logger.error(f"Error displaying profile: {e}")
+        logger.error("Error displaying profile: %s", e)
         await context.bot.send_message(chat_id, f"Ошибка при отображении анкеты: {e}", reply_markup=get_main_menu())
+        return
+    store.mark_seen(update.effective_user.id, [profile['telegram_id']])
+
+def collect_album_page(store, viewer_id, ids, start):
+    page = []
+    pos = start
+    while pos < len(ids) and len(page) < ALBUM_SIZE:
+        candidate_id = ids[pos]
+        pos += 1
+        if store.has_user(candidate_id) and not store.is_blocked(viewer_id, candidate_id) \
+                and not already_seen(store, viewer_id, candidate_id):
+            page.append(candidate_id)
+    return page, pos
+
+def album_keyboard(page):
+    likes = [InlineKeyboardButton(f"❤️ {number}", callback_data=f"alike_{candidate_id}") for number, candidate_id in enumerate(page, 1)]
+    keyboard = [likes[i:i + 5] for i in range(0, len(likes), 5)]
+    keyboard.append([
+        InlineKeyboardButton("➡️ Следующие", callback_data="album_next"),
+        InlineKeyboardButton("⬅️ Главное меню", callback_data="back_to_menu")
+    ])
+    return InlineKeyboardMarkup(keyboard)
+
+async def show_album(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.effective_chat.id
+    viewer_id = update.effective_user.id
+    store = get_store(context)
+    cards = get_cards(context)
+    browse = context.user_data.get('browse')
+    page, end = [], 0
+    if browse:
+        prefetched = browse.get('next_page')
+        if prefetched and prefetched['start'] == browse['pos']:
+            page = [t for t in prefetched['ids'] if store.has_user(t) and not store.is_blocked(viewer_id, t)]
+            end = prefetched['end']
+        if not page:
+            page, end = collect_album_page(store, viewer_id, browse['ids'], browse['pos'])
+    if not page:
+        await context.bot.send_message(chat_id, NO_MORE_PROFILES, reply_markup=get_main_menu())
+        return
+    update_logger.info("Displaying album of %s profiles for user: %s", len(page), viewer_id)
+    profiles = [store.get_user(t) for t in page]
+    text = f"Анкеты 1–{len(page)}: нажмите ❤️ с номером анкеты, чтобы поставить лайк."
+    try:
+        if len(profiles) == 1:
+            await context.bot.send_photo(chat_id=chat_id, photo=profiles[0]['photo_id'],
+                                         caption=f"1. {cards.get('album', profiles[0])[0]}", reply_markup=album_keyboard(page))
+        else:
+            await context.bot.send_media_group(chat_id=chat_id, media=[
+                InputMediaPhoto(media=profile['photo_id'], caption=f"{number}. {cards.get('album', profile)[0]}")
+                for number, profile in enumerate(profiles, 1)
+            ])
+            await context.bot.send_message(chat_id, text, reply_markup=album_keyboard(page))
+    except Exception as e:
+        logger.error("Error displaying album: %s", e)
+        await context.bot.send_message(chat_id, f"Ошибка при отображении анкет: {e}", reply_markup=get_main_menu())
+        return
+    store.mark_seen(viewer_id, page)
+
+    browse['page_end'] = end
+    next_page, next_end = collect_album_page(store, viewer_id, browse['ids'], end)
+    for candidate_id in next_page:
+        cards.get('album', store.get_user(candidate_id))
+    browse['next_page'] = {'start': end, 'end': next_end, 'ids': next_page}
+
+async def next_album(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    update_logger.info("Received album_next from user: %s", query.from_user.id)
+    browse = context.user_data.get('browse')
+    if browse:
+        browse['pos'] = browse.get('page_end', browse['pos'])
+    await query.message.delete()
+    if context.user_data.get('browse_mode') == 'album':
+        await show_album(update, context)
+    else:
+        await show_profile(update, context)
+
+async def toggle_album_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    album = context.user_data.get('browse_mode') != 'album'
+    context.user_data['browse_mode'] = 'album' if album else 'single'
+    logger.info("User %s switched browse mode to %s", update.effective_user.id, context.user_data['browse_mode'])
+    if album:
+        await update.message.reply_text(f"Режим альбома включён: со следующей анкеты они будут приходить группами по {ALBUM_SIZE}.")
+    else:
+        await update.message.reply_text("Режим альбома выключен: со следующей анкеты они снова будут приходить по одной.")
 
 async def back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -524,21 +743,38 @@ async def back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
     await context.bot.send_message(chat_id, "Выберите действие:", reply_markup=get_main_menu())
 
+def notify_match(context, store, liking_user_id, liked_user_id):
+    liked_user = store.get_user(liked_user_id)
+    liking_user = store.get_user(liking_user_id)
+    get_outbox(context).send_message(liked_user_id, f"У вас мэтч с {liking_user['name']}!")
+    get_outbox(context).send_message(liking_user_id, f"У вас мэтч с {liked_user['name']}!")
+
+async def like_from_album(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    update_logger.info("Received album like from user: %s for user: %s", query.from_user.id, query.data)
+    liked_user_id = int(query.data.split('_')[1])
+    liking_user_id = query.from_user.id
+    store = get_store(context)
+    if not store.has_user(liked_user_id):
+        await query.answer("Эта анкета больше недоступна.")
+        return
+    if store.has_like(liking_user_id, liked_user_id):
+        await query.answer("Вы уже поставили лайк этой анкете.")
+        return
+    matched = await get_writer(context).submit(store.like, liking_user_id, liked_user_id)
+    if matched:
+        notify_match(context, store, liking_user_id, liked_user_id)
+    await query.answer("💖 Это мэтч!" if matched else "❤️ Вы поставили лайк!")
+
 async def like_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    logger.info(f"Received like from user: {query.from_user.id} for user: {query.data}")
+    update_logger.info("Received like from user: %s for user: %s", query.from_user.id, query.data)
     liked_user_id = int(query.data.split('_')[1])
     liking_user_id = query.from_user.id
-    db = load_db()
-    db['likes'].append({'liker_id': liking_user_id, 'liked_id': liked_user_id})
-    if any(l['liker_id'] == liked_user_id and l['liked_id'] == liking_user_id for l in db['likes']):
-        db['matches'].append({'user1_id': min(liking_user_id, liked_user_id), 'user2_id': max(liking_user_id, liked_user_id)})
-        liked_user = next(u for u in db['users'] if u['telegram_id'] == liked_user_id)
-        liking_user = next(u for u in db['users'] if u['telegram_id'] == liking_user_id)
-        await context.bot.send_message(liked_user_id, f"У вас мэтч с {liking_user['name']}!")
-        await context.bot.send_message(liking_user_id, f"У вас мэтч с {liking_user['name']}!")
-    save_db(db)
+    store = get_store(context)
+    if await get_writer(context).submit(store.like, liking_user_id, liked_user_id):
+        notify_match(context, store, liking_user_id, liked_user_id)
     keyboard = [
         [InlineKeyboardButton("➡️ Следующая анкета", callback_data="next")],
         [InlineKeyboardButton("⚠️ Пожаловаться", callback_data=f"report_{liked_user_id}")],
@@ -553,34 +789,42 @@ async def like_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def next_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    logger.info(f"Received next from user: {query.from_user.id}")
-    context.user_data['current_profile'] = context.user_data.get('current_profile', 0) + 1
-    profiles = context.user_data.get('profiles', [])
-    index = context.user_data['current_profile']
-    if index >= len(profiles):
+    update_logger.info("Received next from user: %s", query.from_user.id)
+    browse = context.user_data.get('browse')
+    if browse:
+        browse['pos'] += 1
+        if context.user_data.get('browse_mode') == 'album' and 'query' not in browse:
+            await query.message.delete()
+            await show_album(update, context)
+            return
+    store = get_store(context)
+    profile = current_browse_profile(context, store, query.from_user.id)
+    if not profile:
         await query.message.delete()
-        await query.message.reply_text("Нет больше анкет для просмотра.", reply_markup=get_main_menu())
+        await query.message.reply_text(NO_MORE_PROFILES, reply_markup=get_main_menu())
         return
-    profile = profiles[index]
-    keyboard = [
-        [InlineKeyboardButton("👍 Лайк", callback_data=f"like_{profile['telegram_id']}")],
-        [InlineKeyboardButton("➡️ Следующая анкета", callback_data="next")],
-        [InlineKeyboardButton("⚠️ Пожаловаться", callback_data=f"report_{profile['telegram_id']}")],
-        [InlineKeyboardButton("⬅️ Главное меню", callback_data="back_to_menu")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    caption, reply_markup = get_cards(context).get('browse', profile)
     await query.edit_message_media(
         media=InputMediaPhoto(
             media=profile['photo_id'],
-            caption=f"Имя: {profile['name']}\nВозраст: {profile['age']}\nПол: {profile['gender']}\nГород: {profile['city'] or 'Не указан'}\nО себе: {profile['bio']}"
+            caption=caption
         ),
         reply_markup=reply_markup
     )
+    store.mark_seen(query.from_user.id, [profile['telegram_id']])
+
+async def reset_seen(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    store = get_store(context)
+    count = await get_writer(context).submit(store.reset_seen, user_id)
+    context.user_data.pop('browse', None)
+    logger.info("User %s reset %s seen profiles", user_id, count)
+    await update.message.reply_text("История просмотров очищена.", reply_markup=get_main_menu())
 
 async def report_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    logger.info(f"Received report from user: {query.from_user.id} for user: {query.data}")
+    logger.info("Received report from user: %s for user: %s", query.from_user.id, query.data)
     reported_user_id = int(query.data.split('_')[1])
     context.user_data['reported_user_id'] = reported_user_id
     await query.message.reply_text("Пожалуйста, укажите причину жалобы.")
@@ -602,20 +846,25 @@ async def get_report_screenshot(update: Update, context: ContextTypes.DEFAULT_TY
     reported_user_id = context.user_data.get('reported_user_id')
     
     if reported_user_id:
-        db = load_db()
-        db['reports'].append({
+        store = get_store(context)
+        await get_writer(context).submit(store.file_report, {
             'reporter_id': reporter_user_id,
             'reported_id': reported_user_id,
             'reason': reason,
             'screenshot_id': screenshot_id
         })
-        db['blocked'].append({'blocker_id': reporter_user_id, 'blocked_id': reported_user_id})
-        save_db(db)
         await update.message.reply_text("Ваша жалоба принята и будет рассмотрена.")
         if ADMIN_CHAT_ID:
-            reporter_user = next((u for u in db['users'] if u['telegram_id'] == reporter_user_id), None)
-            reported_user = next((u for u in db['users'] if u['telegram_id'] == reported_user_id), None)
-            if reporter_user and reported_user:
+            reporter_user = store.get_user(reporter_user_id)
+            reported_user = store.get_user(reported_user_id)
+            digest = context.bot_data.get('report_digest')
+            if reporter_user and reported_user and digest:
+                digest.add(
+                    {'reporter_id': reporter_user_id, 'reported_id': reported_user_id, 'reason': reason, 'screenshot_id': screenshot_id},
+                    reporter_user['name'],
+                    reported_user['name']
+                )
+            elif reporter_user and reported_user:
                 keyboard = [
                     [InlineKeyboardButton("Забанить", callback_data=f"ban_{reported_user_id}")],
                     [InlineKeyboardButton("Игнорировать жалобу", callback_data=f"ignore_{reported_user_id}")]
@@ -629,9 +878,9 @@ async def get_report_screenshot(update: Update, context: ContextTypes.DEFAULT_TY
                     f"На пользователя: {reported_user['name']} (ID: {reported_user_id}, [Профиль]({reported_link}))\n"
                     f"Причина: {reason}"
                 )
-                await context.bot.send_photo(
-                    chat_id=ADMIN_CHAT_ID,
-                    photo=screenshot_id,
+                get_outbox(context).send_photo(
+                    ADMIN_CHAT_ID,
+                    screenshot_id,
                     caption=message,
                     reply_markup=reply_markup,
                     parse_mode="Markdown"
@@ -642,28 +891,35 @@ async def get_report_screenshot(update: Update, context: ContextTypes.DEFAULT_TY
         await update.message.reply_text("Произошла ошибка при обработке жалобы.")
         return ConversationHandler.END
 
+async def dismiss_report_buttons(query, user_id):
+    handled = {f"ban_{user_id}", f"ignore_{user_id}"}
+    markup = query.message.reply_markup
+    rows = [row for row in (markup.inline_keyboard if markup else []) if not any(b.callback_data in handled for b in row)]
+    if rows:
+        await query.edit_message_reply_markup(reply_markup=InlineKeyboardMarkup(rows))
+    else:
+        await query.message.delete()
+
 async def ban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    logger.info(f"Received ban request from admin for user: {query.data}")
+    logger.info("Received ban request from admin for user: %s", query.data)
     user_id = int(query.data.split('_')[1])
-    db = load_db()
-    if any(u['telegram_id'] == user_id for u in db['users']):
-        db['users'] = [u for u in db['users'] if u['telegram_id'] != user_id]
-        db['blocked'].append({'blocker_id': int(ADMIN_CHAT_ID), 'blocked_id': user_id})
-        save_db(db)
+    store = get_store(context)
+    if await get_writer(context).submit(store.ban_user, user_id, int(ADMIN_CHAT_ID)):
+        get_cards(context).invalidate(user_id)
         await query.message.reply_text(f"Пользователь ID {user_id} забанен.")
     else:
         await query.message.reply_text(f"Пользователь ID {user_id} не найден.")
-    await query.message.delete()
+    await dismiss_report_buttons(query, user_id)
 
 async def ignore_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    logger.info(f"Received ignore request for report on user: {query.data}")
+    logger.info("Received ignore request for report on user: %s", query.data)
     user_id = int(query.data.split('_')[1])
     await query.message.reply_text(f"Жалоба на пользователя ID {user_id} проигнорирована.")
-    await query.message.delete()
+    await dismiss_report_buttons(query, user_id)
 
 async def feedback_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.callback_query:
@@ -675,13 +931,13 @@ async def feedback_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         message = update.message
 
-    logger.info(f"Starting feedback process for user: {update.effective_user.id}")
+    logger.info("Starting feedback process for user: %s", update.effective_user.id)
     await message.reply_text("Пожалуйста, опишите ваш отзыв, предложение или проблему.", reply_markup=ReplyKeyboardRemove())
     return GET_FEEDBACK_MESSAGE
 
 async def get_feedback_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['feedback_message'] = update.message.text
-    logger.info(f"Received feedback message from user {update.effective_user.id}: {update.message.text}")
+    logger.info("Received feedback message from user %s: %s", update.effective_user.id, update.message.text)
     await update.message.reply_text("Если вы хотите, чтобы мы связались с вами, укажите ваш контакт (например, Telegram @username). Если нет, просто напишите 'Нет'.")
     return GET_FEEDBACK_CONTACT
 
@@ -689,18 +945,17 @@ async def get_feedback_contact(update: Update, context: ContextTypes.DEFAULT_TYP
     contact = update.message.text
     feedback_message = context.user_data.get('feedback_message')
     user_id = update.message.from_user.id
-    db = load_db()
+    store = get_store(context)
     feedback_entry = {
         'user_id': user_id,
         'message': feedback_message,
         'contact': contact if contact.lower() != 'нет' else None
     }
-    db['feedback'].append(feedback_entry)
-    save_db(db)
-    logger.info(f"Feedback saved for user {user_id}")
+    await get_writer(context).submit(store.add_feedback, feedback_entry)
+    logger.info("Feedback saved for user %s", user_id)
     await update.message.reply_text("Спасибо за ваш отзыв! Мы рассмотрим его в ближайшее время.", reply_markup=get_main_menu())
     if ADMIN_CHAT_ID:
-        user = next((u for u in db['users'] if u['telegram_id'] == user_id), None)
+        user = store.get_user(user_id)
         user_name = user['name'] if user else f"ID {user_id}"
         user_link = f"tg://user?id={user_id}"
         message = (
@@ -709,42 +964,136 @@ async def get_feedback_contact(update: Update, context: ContextTypes.DEFAULT_TYP
             f"Сообщение: {feedback_message}\n"
             f"Контакт: {contact if contact.lower() != 'нет' else 'Не указан'}"
         )
-        await context.bot.send_message(ADMIN_CHAT_ID, message, parse_mode="Markdown")
+        get_outbox(context).send_message(ADMIN_CHAT_ID, message, parse_mode="Markdown")
     context.user_data.clear()
     return ConversationHandler.END
 
+def render_matches_page(store, user_id, page):
+    total = store.match_count(user_id)
+    pages = max(1, -(-total // MATCHES_PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
+    lines = [f"Ваши мэтчи ({total}), страница {page + 1} из {pages}:"]
+    keyboard = []
+    for other_id in store.match_page(user_id, page * MATCHES_PAGE_SIZE, MATCHES_PAGE_SIZE):
+        other_user = store.get_user(other_id)
+        if other_user is None:
+            continue
+        lines.append(f"- {other_user['name']} (Возраст: {other_user['age']}, Пол: {other_user['gender']})")
+        keyboard.append([InlineKeyboardButton(f"Начать чат с {other_user['name'][:40]}", callback_data=f"chat_{other_id}")])
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"matches_page_{page - 1}"))
+    if page < pages - 1:
+        navigation.append(InlineKeyboardButton("Вперёд ➡️", callback_data=f"matches_page_{page + 1}"))
+    if navigation:
+        keyboard.append(navigation)
+    keyboard.append([InlineKeyboardButton("⬅️ Главное меню", callback_data="back_to_menu")])
+    return '\n'.join(lines)[:4096], InlineKeyboardMarkup(keyboard)
+
 async def matches(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.callback_query:
-        query = update.callback_query
+    user_id = update.effective_user.id
+    store = get_store(context)
+    query = update.callback_query
+    if query and query.data.startswith('matches_page_'):
+        await query.answer()
+        text, reply_markup = render_matches_page(store, user_id, int(query.data.rsplit('_', 1)[1]))
+        await query.edit_message_text(text, reply_markup=reply_markup)
+        return
+
+    if query:
         chat_id = query.message.chat_id
         message_id = query.message.message_id
         await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
     else:
         chat_id = update.message.chat_id
 
-    user_id = update.effective_user.id
-    db = load_db()
-    user_matches = [m for m in db['matches'] if m['user1_id'] == user_id or m['user2_id'] == user_id]
-    if not user_matches:
+    if not store.match_count(user_id):
         await context.bot.send_message(chat_id, "У вас пока нет мэтчей.", reply_markup=get_main_menu())
         return
-    message = "Ваши мэтчи:\n"
+    text, reply_markup = render_matches_page(store, user_id, 0)
+    await context.bot.send_message(chat_id, text, reply_markup=reply_markup)
+
+def render_likes_page(store, user_id, page):
+    page = max(page, 0)
+    likers = store.inbox_page(user_id, page * LIKES_PAGE_SIZE, LIKES_PAGE_SIZE + 1)
+    while not likers and page > 0:
+        page -= 1
+        likers = store.inbox_page(user_id, page * LIKES_PAGE_SIZE, LIKES_PAGE_SIZE + 1)
+    has_more = len(likers) > LIKES_PAGE_SIZE
+    lines = [f"Вам поставили лайк, страница {page + 1}:"]
     keyboard = []
-    for match in user_matches:
-        other_id = match['user2_id'] if match['user1_id'] == user_id else match['user1_id']
-        other_user = next(u for u in db['users'] if u['telegram_id'] == other_id)
-        message += f"- {other_user['name']} (Возраст: {other_user['age']}, Пол: {other_user['gender']})\n"
-        keyboard.append([InlineKeyboardButton(f"Начать чат с {other_user['name']}", callback_data=f"chat_{other_id}")])
+    for number, liker_id in enumerate(likers[:LIKES_PAGE_SIZE], 1):
+        liker = store.get_user(liker_id)
+        lines.append(f"\n{number}. {render_caption(liker)[:600]}")
+        keyboard.append([
+            InlineKeyboardButton(f"❤️ {number}. {liker['name'][:30]}", callback_data=f"inbox_like_{liker_id}_{page}"),
+            InlineKeyboardButton("✖️ Пропустить", callback_data=f"inbox_skip_{liker_id}_{page}")
+        ])
+    if not keyboard:
+        lines.append("\nНовых лайков нет.")
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"likes_page_{page - 1}"))
+    if has_more:
+        navigation.append(InlineKeyboardButton("Вперёд ➡️", callback_data=f"likes_page_{page + 1}"))
+    if navigation:
+        keyboard.append(navigation)
     keyboard.append([InlineKeyboardButton("⬅️ Главное меню", callback_data="back_to_menu")])
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await context.bot.send_message(chat_id, message, reply_markup=reply_markup)
+    return '\n'.join(lines)[:4096], InlineKeyboardMarkup(keyboard)
+
+async def likes_inbox(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    store = get_store(context)
+    query = update.callback_query
+    update_logger.info("Received likes inbox request from user: %s", user_id)
+    if query and query.data.startswith('likes_page_'):
+        await query.answer()
+        text, reply_markup = render_likes_page(store, user_id, int(query.data.rsplit('_', 1)[1]))
+        await query.edit_message_text(text, reply_markup=reply_markup)
+        return
+
+    if query:
+        chat_id = query.message.chat_id
+        message_id = query.message.message_id
+        await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
+    else:
+        chat_id = update.message.chat_id
+
+    if not store.has_user(user_id):
+        await context.bot.send_message(chat_id, "Пожалуйста, зарегистрируйтесь.", reply_markup=get_main_menu())
+        return
+    if not store.has_inbox(user_id):
+        await context.bot.send_message(chat_id, "Пока никто не поставил вам лайк.", reply_markup=get_main_menu())
+        return
+    text, reply_markup = render_likes_page(store, user_id, 0)
+    await context.bot.send_message(chat_id, text, reply_markup=reply_markup)
+
+async def answer_inbox_like(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    update_logger.info("Received inbox answer from user: %s: %s", query.from_user.id, query.data)
+    _, action, liker_id, page = query.data.split('_')
+    liker_id, page = int(liker_id), int(page)
+    user_id = query.from_user.id
+    store = get_store(context)
+    if not store.in_inbox(user_id, liker_id):
+        await query.answer("Вы уже ответили на этот лайк.")
+    elif action == 'like':
+        matched = await get_writer(context).submit(store.like, user_id, liker_id)
+        if matched:
+            notify_match(context, store, user_id, liker_id)
+        await query.answer("💖 Это мэтч!" if matched else "Эта анкета больше недоступна.")
+    else:
+        await get_writer(context).submit(store.skip_like, user_id, liker_id)
+        await query.answer("Лайк пропущен.")
+    text, reply_markup = render_likes_page(store, user_id, page)
+    await query.edit_message_text(text, reply_markup=reply_markup)
 
 async def start_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     matched_user_id = int(query.data.split('_')[1])
-    db = load_db()
-    matched_user = next((u for u in db['users'] if u['telegram_id'] == matched_user_id), None)
+    store = get_store(context)
+    matched_user = store.get_user(matched_user_id)
     if matched_user:
         await query.message.reply_text(f"Вы выбрали пользователя @{matched_user['username']}. Найдите его в Telegram и начните чат!", reply_markup=get_main_menu())
     else:
@@ -754,13 +1103,162 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Операция отменена.", reply_markup=get_main_menu())
     return ConversationHandler.END
 
+async def touch_session(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user:
+        context.bot_data['sessions'].touch(update.effective_user.id)
+
+async def conversation_timed_out(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    for key in ('name', 'age', 'gender', 'city', 'photo_id', 'reported_user_id', 'report_reason', 'feedback_message'):
+        context.user_data.pop(key, None)
+    logger.info("Conversation of user %s timed out", update.effective_user.id if update.effective_user else None)
+    if update.effective_chat:
+        get_outbox(context).send_message(update.effective_chat.id, "Время ожидания истекло, действие отменено.",
+                                         reply_markup=get_main_menu())
+
 async def ignore_non_admin_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    logger.info(f"Ignoring message in admin chat from user {update.effective_user.id}: {update.message.text}")
+    logger.info("Ignoring message in admin chat from user %s: %s", update.effective_user.id, update.message.text)
     return
 
-def main():
-    application = Application.builder().token(BOT_TOKEN).build()
-    logger.info("Bot started")
+async def collect_garbage(context: ContextTypes.DEFAULT_TYPE):
+    store = get_store(context)
+    garbage = store.garbage_ids()
+    if not garbage:
+        return
+    started = time.perf_counter()
+    reclaimed = await get_writer(context).submit(store.purge, garbage)
+    logger.info("Purged edges of %s removed users: %s likes and %s blocks in %.3fs",
+                reclaimed['users'], reclaimed['likes'], reclaimed['blocked'], time.perf_counter() - started)
+    metrics = context.bot_data['metrics']
+    metrics.inc('gc_runs_total')
+    for kind in ('users', 'likes', 'blocked'):
+        metrics.inc('gc_reclaimed_total', reclaimed[kind], kind=kind)
+    if ADMIN_CHAT_ID and (reclaimed['likes'] or reclaimed['blocked']):
+        get_outbox(context).send_message(
+            ADMIN_CHAT_ID,
+            f"Очистка после банов: удалено {reclaimed['likes']} лайков и {reclaimed['blocked']} блокировок "
+            f"у {reclaimed['users']} пользователей."
+        )
+
+def check_index():
+    problems = create_backend().read_store().check_index()
+    for problem in problems:
+        logger.error("Index inconsistency: %s", problem)
+    logger.info("Index check finished with %s problems", len(problems))
+    sys.exit(1 if problems else 0)
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates):
+        super().__init__(2 ** 31 - 1)
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self._locks = {}
+
+    @staticmethod
+    def ordering_key(update):
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self.ordering_key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0], self._slots:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+async def sync_cluster(application: Application):
+    bot_data = application.bot_data
+    store = bot_data['store']
+    for event in await bot_data['backend'].sync():
+        if event['op'] in ('user_update', 'user_remove', 'ban'):
+            bot_data['cards'].invalidate(event['telegram_id'])
+        elif event['op'] == 'match' and event.get('by') == bot_data['worker_index']:
+            logger.info("Settled cross-worker match between %s and %s", event['user1_id'], event['user2_id'])
+            notify_match(application, store, event['user1_id'], event['user2_id'])
+
+async def post_init(application: Application):
+    application.bot_data['writer'].start()
+    application.bot_data['backend'].start()
+    application.bot_data['outbox'] = Outbox(
+        application.bot,
+        global_rate=OUTBOX_GLOBAL_RATE / application.bot_data['workers'],
+        per_chat_rate=OUTBOX_PER_CHAT_RATE,
+        concurrency=OUTBOX_CONCURRENCY
+    )
+    application.bot_data['outbox'].start()
+    if GC_INTERVAL > 0 and application.job_queue is not None and not application.bot_data['worker_index']:
+        application.job_queue.run_repeating(collect_garbage, interval=GC_INTERVAL, first=60, name='garbage_collection')
+    if SESSION_EVICT_INTERVAL > 0 and application.job_queue is not None:
+        application.job_queue.run_repeating(application.bot_data['sessions'].job, interval=SESSION_EVICT_INTERVAL,
+                                            first=SESSION_EVICT_INTERVAL, name='session_eviction')
+    if METRICS_INTERVAL > 0 and application.job_queue is not None:
+        application.job_queue.run_repeating(application.bot_data['metrics'].job, interval=METRICS_INTERVAL,
+                                            first=METRICS_INTERVAL, data=application.bot_data['metrics_file'], name='metrics')
+    if ADMIN_CHAT_ID and REPORT_DIGEST_INTERVAL > 0:
+        if application.job_queue is None:
+            logger.warning("REPORT_DIGEST_INTERVAL is set but the JobQueue is unavailable, sending reports immediately")
+        else:
+            digest = ReportDigest(application.bot_data['outbox'], ADMIN_CHAT_ID, alert_threshold=REPORT_ALERT_THRESHOLD)
+            application.bot_data['report_digest'] = digest
+            application.job_queue.run_repeating(digest.job, interval=REPORT_DIGEST_INTERVAL, first=REPORT_DIGEST_INTERVAL, name='report_digest')
+
+async def post_shutdown(application: Application):
+    if 'report_digest' in application.bot_data:
+        application.bot_data['report_digest'].flush()
+    await application.bot_data['outbox'].close()
+    await application.bot_data['writer'].close()
+    await application.bot_data['backend'].close()
+    if METRICS_INTERVAL > 0:
+        application.bot_data['metrics'].write(application.bot_data['metrics_file'])
+
+def build_application(worker_index=None, workers=1):
+    metrics = Metrics()
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES))
+        .request(InstrumentedRequest(metrics, connection_pool_size=MAX_CONCURRENT_UPDATES + OUTBOX_CONCURRENCY))
+        .persistence(SessionPersistence(SESSION_FILE, max_idle=SESSION_MAX_IDLE, update_interval=SESSION_UPDATE_INTERVAL))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+    backend = create_backend(origin=worker_index)
+    backend.on_io = metrics.record_db_io
+    application.bot_data['worker_index'] = worker_index
+    application.bot_data['workers'] = workers
+    application.bot_data['metrics_file'] = METRICS_FILE if worker_index is None else f"{METRICS_FILE}.{worker_index}"
+    application.bot_data['metrics'] = metrics
+    application.bot_data['store'] = backend.load()
+    if ADMIN_CHAT_ID:
+        adopted = application.bot_data['store'].adopt_legacy_bans(int(ADMIN_CHAT_ID), convert=not worker_index)
+        if adopted:
+            logger.info("Converted %s legacy admin blocks into bans", adopted)
+    application.bot_data['backend'] = backend
+    application.bot_data['writer'] = StoreWriter(application.bot_data['store'])
+    application.bot_data['cards'] = CardCache(application.bot_data['store'], max_size=CARD_CACHE_SIZE)
+    application.bot_data['sessions'] = SessionEvictor(ttl=SESSION_TTL, max_bytes=SESSION_MAX_BYTES)
+    if not ranking.AVAILABLE:
+        logger.warning("NumPy is not installed, browse feed falls back to registration order")
 
     register_handler = ConversationHandler(
         entry_points=[
@@ -768,6 +1266,7 @@ def main():
             CallbackQueryHandler(register_start, pattern='^menu_register$')
         ],
         states={
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, conversation_timed_out)],
             GET_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_name)],
             GET_AGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_age)],
             GET_GENDER: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_gender)],
@@ -776,12 +1275,16 @@ def main():
             GET_BIO: [MessageHandler(filters.PHOTO, get_bio)],
             REGISTER: [MessageHandler(filters.TEXT & ~filters.COMMAND, complete_registration)],
         },
-        fallbacks=[CommandHandler("cancel", cancel)]
+        fallbacks=[CommandHandler("cancel", cancel)],
+        conversation_timeout=CONVERSATION_TIMEOUT or None,
+        name="registration",
+        persistent=True
     )
 
     edit_profile_handler = ConversationHandler(
         entry_points=[CommandHandler("edit_profile", edit_profile)],
         states={
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, conversation_timed_out)],
             EDIT_PROFILE: [
                 MessageHandler(filters.Regex(".*Изменить имя.*"), edit_name),
                 MessageHandler(filters.Regex(".*Изменить возраст.*"), edit_age),
@@ -799,16 +1302,23 @@ def main():
             EDIT_PHOTO: [MessageHandler(filters.PHOTO, update_photo)],
             EDIT_BIO: [MessageHandler(filters.TEXT & ~filters.COMMAND, update_bio)],
         },
-        fallbacks=[CommandHandler("cancel", cancel)]
+        fallbacks=[CommandHandler("cancel", cancel)],
+        conversation_timeout=CONVERSATION_TIMEOUT or None,
+        name="edit_profile",
+        persistent=True
     )
 
     report_handler = ConversationHandler(
         entry_points=[CallbackQueryHandler(report_profile, pattern='^report_')],
         states={
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, conversation_timed_out)],
             GET_REPORT_REASON: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_report_reason)],
             GET_REPORT_SCREENSHOT: [MessageHandler(filters.ALL, get_report_screenshot)],
         },
-        fallbacks=[CommandHandler("cancel", cancel)]
+        fallbacks=[CommandHandler("cancel", cancel)],
+        conversation_timeout=CONVERSATION_TIMEOUT or None,
+        name="report",
+        persistent=True
     )
 
     feedback_handler = ConversationHandler(
@@ -817,24 +1327,54 @@ def main():
             CallbackQueryHandler(feedback_start, pattern='^menu_feedback$')
         ],
         states={
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, conversation_timed_out)],
             GET_FEEDBACK_MESSAGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_feedback_message)],
             GET_FEEDBACK_CONTACT: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_feedback_contact)],
         },
-        fallbacks=[CommandHandler("cancel", cancel)]
+        fallbacks=[CommandHandler("cancel", cancel)],
+        conversation_timeout=CONVERSATION_TIMEOUT or None,
+        name="feedback",
+        persistent=True
+    )
+
+    search_handler = ConversationHandler(
+        entry_points=[
+            CommandHandler("search", search_start),
+            CallbackQueryHandler(search_start, pattern='^menu_search$')
+        ],
+        states={
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, conversation_timed_out)],
+            SEARCH_QUERY: [MessageHandler(filters.TEXT & ~filters.COMMAND, search_query)],
+        },
+        fallbacks=[CommandHandler("cancel", cancel)],
+        conversation_timeout=CONVERSATION_TIMEOUT or None,
+        name="search",
+        persistent=True
     )
 
+    application.add_handler(TypeHandler(Update, touch_session), group=-1)
     application.add_handler(register_handler)
     application.add_handler(edit_profile_handler)
     application.add_handler(report_handler)
     application.add_handler(feedback_handler)
+    application.add_handler(search_handler)
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("profile", profile))
     application.add_handler(CommandHandler("browse", browse_profiles))
     application.add_handler(CommandHandler("matches", matches))
+    application.add_handler(CommandHandler("likes", likes_inbox))
+    application.add_handler(CommandHandler("stats", stats, filters=filters.Chat(int(ADMIN_CHAT_ID))))
     application.add_handler(CallbackQueryHandler(menu_handler, pattern='^menu_'))
     application.add_handler(CallbackQueryHandler(back_to_menu, pattern='^back_to_menu$'))
     application.add_handler(CallbackQueryHandler(like_profile, pattern='^like_'))
     application.add_handler(CallbackQueryHandler(next_profile, pattern='^next$'))
+    application.add_handler(CommandHandler("album", toggle_album_mode))
+    application.add_handler(CommandHandler("reset_seen", reset_seen))
+    application.add_handler(CallbackQueryHandler(like_from_album, pattern='^alike_'))
+    application.add_handler(CallbackQueryHandler(next_album, pattern='^album_next$'))
+    application.add_handler(CallbackQueryHandler(matches, pattern='^matches_page_'))
+    application.add_handler(CallbackQueryHandler(likes_inbox, pattern='^likes_page_'))
+    application.add_handler(CallbackQueryHandler(answer_inbox_like, pattern='^inbox_(like|skip)_'))
     application.add_handler(CallbackQueryHandler(start_chat, pattern='^chat_'))
     application.add_handler(CallbackQueryHandler(ban_user, pattern='^ban_'))
     application.add_handler(CallbackQueryHandler(ignore_report, pattern='^ignore_'))
@@ -842,8 +1382,63 @@ def main():
         filters.TEXT & ~filters.COMMAND & filters.Chat(int(ADMIN_CHAT_ID)),
         ignore_non_admin_messages
     ))
+    metrics.instrument_handlers(application)
+    metrics.add_collector(lambda: runtime_gauges(application.bot_data))
+    return application
+
+def run_worker(index, workers, updates, heartbeat):
+    application = build_application(worker_index=index, workers=workers)
+    logger.info("Worker %s/%s started", index, workers)
+    asyncio.run(serve_worker(application, updates, heartbeat, on_start=post_init, on_stop=post_shutdown,
+                             on_tick=sync_cluster, tick_interval=CLUSTER_SYNC_INTERVAL))
+
+def run_cluster():
+    if DB_BACKEND != 'sqlite':
+        logger.error("CLUSTER_WORKERS needs DB_BACKEND=sqlite so workers can share the store")
+        sys.exit(1)
+    pool = WorkerPool(run_worker, CLUSTER_WORKERS, health_timeout=CLUSTER_HEALTH_TIMEOUT)
+    bot = Bot(BOT_TOKEN)
+    server = None
+    webhook_url = None
+    if BOT_MODE == 'webhook':
+        server = WebhookServer(
+            None,
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            path=WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET_TOKEN,
+            dispatch=pool.dispatch,
+            health=pool.healthy
+        )
+        webhook_url = f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH.strip('/')}" if WEBHOOK_URL else None
+    logger.info("Bot started with %s workers", CLUSTER_WORKERS)
+    asyncio.run(serve_ingress(bot, pool, server, webhook_url))
 
-    application.run_polling()
+def main():
+    if CLUSTER_WORKERS > 0:
+        run_cluster()
+        return
+    application = build_application()
+    logger.info("Bot started")
+    if BOT_MODE == 'webhook':
+        server = WebhookServer(
+            application,
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            path=WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET_TOKEN,
+            wait_for_handlers=WEBHOOK_WAIT_FOR_HANDLERS,
+            metrics=application.bot_data['metrics']
+        )
+        webhook_url = f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH.strip('/')}" if WEBHOOK_URL else None
+        asyncio.run(serve_webhook(application, server, webhook_url, on_start=post_init, on_stop=post_shutdown))
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=False)
 
 if __name__ == '__main__':
-    main()
+    if len(sys.argv) > 1 and sys.argv[1] == 'migrate':
+        migrate_json_to_sqlite(sys.argv[2] if len(sys.argv) > 2 else DB_FILE, DB_SQLITE_FILE, DB_JOURNAL_FILE)
+    elif len(sys.argv) > 1 and sys.argv[1] == 'check-index':
+        check_index()
+    else:
+        main()
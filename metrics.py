@@ -0,0 +1,201 @@
+import functools
+import logging
+import os
+import time
+from bisect import bisect_left
+
+from telegram.ext import ConversationHandler
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+def format_labels(labels, extra=None):
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in items)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + '}'
+
+
+class Metrics:
+    def __init__(self, prefix='bot'):
+        self.prefix = prefix
+        self.started = time.time()
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = []
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def total(self, name, **labels):
+        wanted = labels.items()
+        return sum(v for (n, l), v in self._counters.items() if n == name and wanted <= dict(l).items())
+
+    def instrument(self, callback):
+        name = getattr(callback, '__name__', repr(callback))
+
+        @functools.wraps(callback)
+        async def wrapped(update, context):
+            started = time.perf_counter()
+            try:
+                return await callback(update, context)
+            except Exception:
+                self.inc('handler_errors_total', handler=name)
+                raise
+            finally:
+                self.observe('handler_latency_seconds', time.perf_counter() - started, handler=name)
+        return wrapped
+
+    def _instrument_handler(self, handler):
+        if isinstance(handler, ConversationHandler):
+            nested = list(handler.entry_points) + list(handler.fallbacks)
+            nested += [h for handlers in handler.states.values() for h in handlers]
+            return sum(self._instrument_handler(h) for h in nested)
+        if hasattr(handler.callback, '__wrapped__'):
+            return 0
+        handler.callback = self.instrument(handler.callback)
+        return 1
+
+    def instrument_handlers(self, application):
+        count = sum(self._instrument_handler(h) for handlers in application.handlers.values() for h in handlers)
+        logger.info("Instrumented %s handlers", count)
+
+    def record_db_io(self, op, seconds, size):
+        self.observe('db_io_seconds', seconds, op=op)
+        self.inc('db_io_bytes_total', size or 0, op=op)
+
+    def render(self):
+        lines = []
+        p = self.prefix
+        lines.append(f"# TYPE {p}_uptime_seconds gauge")
+        lines.append(f"{p}_uptime_seconds {time.time() - self.started:.3f}")
+        for name in sorted({n for n, _ in self._counters}):
+            lines.append(f"# TYPE {p}_{name} counter")
+            for (n, labels), value in sorted(self._counters.items()):
+                if n == name:
+                    lines.append(f"{p}_{name}{format_labels(labels)} {value}")
+        for name in sorted({n for n, _ in self._histograms}):
+            lines.append(f"# TYPE {p}_{name} histogram")
+            for (n, labels), histogram in sorted(self._histograms.items()):
+                if n != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{p}_{name}_bucket{format_labels(labels, ('le', bound))} {cumulative}")
+                lines.append(f"{p}_{name}_bucket{format_labels(labels, ('le', '+Inf'))} {histogram.count}")
+                lines.append(f"{p}_{name}_sum{format_labels(labels)} {histogram.sum:.6f}")
+                lines.append(f"{p}_{name}_count{format_labels(labels)} {histogram.count}")
+        gauges = {}
+        for collector in self._collectors:
+            try:
+                for name, value, labels in collector():
+                    gauges.setdefault(name, []).append((tuple(sorted(labels.items())), value))
+            except Exception as e:
+                logger.error("Metrics collector %s failed: %s", collector, e)
+        for name, samples in sorted(gauges.items()):
+            lines.append(f"# TYPE {p}_{name} gauge")
+            for labels, value in samples:
+                lines.append(f"{p}_{name}{format_labels(labels)} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+    def summary(self, limit=25):
+        uptime = int(time.time() - self.started)
+        lines = [f"Статистика за {uptime // 3600}ч {uptime % 3600 // 60}м"]
+        for collector in self._collectors:
+            try:
+                lines.extend(f"{name}{format_labels(sorted(labels.items()))}: {value}" for name, value, labels in collector())
+            except Exception as e:
+                lines.append(f"{collector}: ошибка {e}")
+
+        def table(title, metric, label, errors=None):
+            rows = sorted(((dict(labels)[label], h) for (n, labels), h in self._histograms.items() if n == metric),
+                          key=lambda row: -row[1].count)
+            if not rows:
+                return
+            lines.append(f"\n{title} (вызовы / ошибки / сред. / p50 / p99, мс):")
+            for key, h in rows[:limit]:
+                failed = self.total(errors, **{label: key}) if errors else 0
+                lines.append(f"{key}: {h.count} / {failed} / {h.sum / h.count * 1000:.1f} / "
+                             f"{h.quantile(0.5) * 1000:g} / {h.quantile(0.99) * 1000:g}")
+
+        table("Обработчики", 'handler_latency_seconds', 'handler', 'handler_errors_total')
+        table("База данных", 'db_io_seconds', 'op')
+        table("Telegram API", 'telegram_api_seconds', 'method', 'telegram_api_errors_total')
+        db_bytes = {dict(labels)['op']: v for (n, labels), v in self._counters.items() if n == 'db_io_bytes_total'}
+        if db_bytes:
+            lines.append("Байт БД: " + ', '.join(f"{op}={size}" for op, size in sorted(db_bytes.items())))
+        return '\n'.join(lines)
+
+    async def job(self, context):
+        path = context.job.data
+        try:
+            self.write(path)
+        except OSError as e:
+            logger.error("Failed to write metrics to %s: %s", path, e)
+
+
+class InstrumentedRequest(HTTPXRequest):
+    def __init__(self, metrics, **kwargs):
+        super().__init__(**kwargs)
+        self.metrics = metrics
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        api_method = 'file_download' if '/file/bot' in url else url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, request_data=request_data, **kwargs)
+        except Exception as e:
+            self.metrics.inc('telegram_api_errors_total', method=api_method, error=type(e).__name__)
+            raise
+        finally:
+            self.metrics.observe('telegram_api_seconds', time.perf_counter() - started, method=api_method)
+        self.metrics.inc('telegram_api_response_bytes_total', len(payload or b''), method=api_method)
+        if code >= 400:
+            self.metrics.inc('telegram_api_errors_total', method=api_method, error=str(code))
+        return code, payload
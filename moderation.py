@@ -0,0 +1,70 @@
+import logging
+from collections import OrderedDict
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
+
+logger = logging.getLogger(__name__)
+
+MEDIA_GROUP_LIMIT = 10
+CAPTION_LIMIT = 1024
+SUMMARY_USERS_PER_MESSAGE = 20
+
+
+class ReportDigest:
+    def __init__(self, outbox, admin_chat_id, alert_threshold=5):
+        self.outbox = outbox
+        self.admin_chat_id = admin_chat_id
+        self.alert_threshold = alert_threshold
+        self._pending = OrderedDict()
+        self.flushed_reports = 0
+
+    @property
+    def pending_reports(self):
+        return sum(len(group['reports']) for group in self._pending.values())
+
+    def add(self, report, reporter_name, reported_name):
+        reported_id = report['reported_id']
+        group = self._pending.setdefault(reported_id, {'name': reported_name, 'reports': []})
+        group['reports'].append({**report, 'reporter_name': reporter_name})
+        if self.alert_threshold and len(group['reports']) >= self.alert_threshold:
+            logger.info("User %s reached %s reports, alerting admins immediately", reported_id, len(group['reports']))
+            self._send({reported_id: self._pending.pop(reported_id)}, urgent=True)
+
+    async def job(self, context):
+        self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        groups, self._pending = self._pending, OrderedDict()
+        self._send(groups)
+
+    def _send(self, groups, urgent=False):
+        media = []
+        for reported_id, group in groups.items():
+            for report in group['reports']:
+                caption = f"Жалоба на {group['name']} (ID: {reported_id}) от {report['reporter_name']}: {report['reason']}"
+                media.append(InputMediaPhoto(media=report['screenshot_id'], caption=caption[:CAPTION_LIMIT]))
+        for start in range(0, len(media), MEDIA_GROUP_LIMIT):
+            chunk = media[start:start + MEDIA_GROUP_LIMIT]
+            if len(chunk) == 1:
+                self.outbox.send_photo(self.admin_chat_id, chunk[0].media, caption=chunk[0].caption)
+            else:
+                self.outbox.send_media_group(self.admin_chat_id, chunk)
+
+        items = list(groups.items())
+        total = sum(len(group['reports']) for _, group in items)
+        for start in range(0, len(items), SUMMARY_USERS_PER_MESSAGE):
+            lines = ["⚠️ Срочно: много жалоб на пользователя" if urgent else f"Сводка жалоб ({total}):"]
+            keyboard = []
+            for reported_id, group in items[start:start + SUMMARY_USERS_PER_MESSAGE]:
+                count = len(group['reports'])
+                reasons = '; '.join(sorted({str(r['reason']) for r in group['reports']}))
+                lines.append(f"- {group['name']} (ID: {reported_id}): {count} жалоб. Причины: {reasons}")
+                keyboard.append([
+                    InlineKeyboardButton(f"Забанить {group['name']} ({count})", callback_data=f"ban_{reported_id}"),
+                    InlineKeyboardButton("Игнорировать", callback_data=f"ignore_{reported_id}")
+                ])
+            self.outbox.send_message(self.admin_chat_id, '\n'.join(lines)[:4096], reply_markup=InlineKeyboardMarkup(keyboard))
+        self.flushed_reports += total
+        logger.info("Sent report digest for %s users (%s reports) to admin chat", len(items), total)
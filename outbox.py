@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import time
+
+from telegram.error import BadRequest, ChatMigrated, Forbidden, NetworkError, RetryAfter, TimedOut
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, now):
+        self.tokens = min(self.capacity, self.tokens + max(now - self.updated, 0.0) * self.rate)
+        self.updated = max(now, self.updated)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def idle(self, now):
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class Outbox:
+    def __init__(self, bot, global_rate=25.0, per_chat_rate=1.0, group_rate=20 / 60, concurrency=8, max_retries=3,
+                 max_chat_buckets=10000):
+        self.bot = bot
+        self.per_chat_rate = per_chat_rate
+        self.group_rate = group_rate
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.max_chat_buckets = max_chat_buckets
+        self._global = TokenBucket(global_rate, capacity=global_rate)
+        self._chats = {}
+        self._paused_until = 0.0
+        self._queue = asyncio.Queue()
+        self._workers = []
+        self._deferred = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.max_depth = 0
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        return {
+            'queue_depth': self.queue_depth,
+            'deferred': self._deferred,
+            'max_queue_depth': self.max_depth,
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+        }
+
+    def enqueue(self, method, chat_id, **kwargs):
+        self._queue.put_nowait((method, chat_id, kwargs, 0, False))
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.enqueue('send_message', chat_id, text=text, **kwargs)
+
+    def send_photo(self, chat_id, photo, **kwargs):
+        self.enqueue('send_photo', chat_id, photo=photo, **kwargs)
+
+    def send_media_group(self, chat_id, media, **kwargs):
+        self.enqueue('send_media_group', chat_id, media=media, **kwargs)
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self._workers = [loop.create_task(self._worker()) for _ in range(self.concurrency)]
+        logger.info("Outbox started with %s workers", self.concurrency)
+
+    def _chat_bucket(self, chat_id, now):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.max_chat_buckets:
+                self._chats = {k: b for k, b in self._chats.items() if not b.idle(now)}
+            rate = self.group_rate if str(chat_id).startswith('-') else self.per_chat_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate)
+        return bucket
+
+    def _release_deferred(self, job):
+        self._deferred -= 1
+        self._queue.put_nowait(job)
+
+    async def _wait_for_global_slot(self):
+        now = time.monotonic()
+        delay = max(self._paused_until - now, self._global.reserve(now))
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._deliver(*job)
+            except Exception as e:
+                self.failed += 1
+                logger.error("Dropping %s to %s after an unexpected error: %r", job[0], job[1], e)
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, method, chat_id, kwargs, attempt, reserved):
+        if not reserved:
+            now = time.monotonic()
+            delay = self._chat_bucket(chat_id, now).reserve(now)
+            if delay > 0:
+                self._deferred += 1
+                asyncio.get_running_loop().call_later(
+                    delay, self._release_deferred, (method, chat_id, kwargs, attempt, True))
+                return
+        await self._wait_for_global_slot()
+        try:
+            await getattr(self.bot, method)(chat_id=chat_id, **kwargs)
+            self.sent += 1
+            return
+        except RetryAfter as e:
+            retry_after = e.retry_after
+            if hasattr(retry_after, 'total_seconds'):
+                retry_after = retry_after.total_seconds()
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            logger.warning("Flood limit hit sending %s to %s, pausing outbox for %ss", method, chat_id, retry_after)
+        except ChatMigrated as e:
+            logger.warning("Chat %s migrated to %s, resending %s there", chat_id, e.new_chat_id, method)
+            chat_id = e.new_chat_id
+        except (Forbidden, BadRequest) as e:
+            self.failed += 1
+            logger.warning("Dropping %s to %s: %s", method, chat_id, e)
+            return
+        except (TimedOut, NetworkError) as e:
+            logger.warning("Network error sending %s to %s (attempt %s): %s", method, chat_id, attempt + 1, e)
+            await asyncio.sleep(min(2 ** attempt, 30))
+        if attempt + 1 > self.max_retries:
+            self.failed += 1
+            logger.error("Giving up on %s to %s after %s attempts", method, chat_id, attempt + 1)
+            return
+        self.retried += 1
+        self._queue.put_nowait((method, chat_id, kwargs, attempt + 1, False))
+
+    async def close(self, timeout=10.0):
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                await asyncio.wait_for(self._queue.join(), max(deadline - time.monotonic(), 0))
+                if not self._deferred and self._queue.empty():
+                    break
+                await asyncio.sleep(0.05)
+        except asyncio.TimeoutError:
+            logger.warning("Outbox closed with %s messages still queued", self.queue_depth)
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        logger.info("Outbox stopped: %s", self.stats())
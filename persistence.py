@@ -0,0 +1,268 @@
+import asyncio
+import json
+import logging
+import pickle
+import sqlite3
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_data (user_id INTEGER PRIMARY KEY, updated REAL NOT NULL, data BLOB NOT NULL);
+CREATE INDEX IF NOT EXISTS user_data_updated ON user_data (updated);
+CREATE TABLE IF NOT EXISTS conversations (name TEXT NOT NULL, key TEXT NOT NULL, updated REAL NOT NULL, state TEXT NOT NULL,
+                                          PRIMARY KEY (name, key));
+CREATE INDEX IF NOT EXISTS conversations_updated ON conversations (updated);
+"""
+
+
+class SessionPersistence(BasePersistence):
+    def __init__(self, path, max_idle=7 * 24 * 3600, update_interval=10):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.path = path
+        self.max_idle = max_idle
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='session-writer')
+        self._conn = None
+        self._loaded_users = set()
+        self._spilled_users = set()
+        self._evicted_users = set()
+        self._dirty_users = {}
+        self._writing_users = {}
+        self._dirty_conversations = {}
+        self._commit_task = None
+        self.loaded = 0
+        self.written = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        return conn
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _prune(self):
+        cutoff = time.time() - self.max_idle
+        with self._conn:
+            users = self._conn.execute("DELETE FROM user_data WHERE updated < ?", (cutoff,)).rowcount
+            conversations = self._conn.execute("DELETE FROM conversations WHERE updated < ?", (cutoff,)).rowcount
+        if users or conversations:
+            logger.info("Pruned %s idle sessions and %s stale conversation states from %s", users, conversations, self.path)
+
+    async def prune(self):
+        if self._conn is not None:
+            await self._run(self._prune)
+
+    async def get_user_data(self):
+        if self._conn is None:
+            self._conn = await self._run(self._connect)
+            await self._run(self._prune)
+        return {}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    def _read_conversations(self, name):
+        rows = self._conn.execute("SELECT key, state FROM conversations WHERE name = ?", (name,)).fetchall()
+        return {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+
+    async def get_conversations(self, name):
+        if self._conn is None:
+            self._conn = await self._run(self._connect)
+        conversations = await self._run(self._read_conversations, name)
+        logger.info("Restored %s '%s' conversation states", len(conversations), name)
+        return conversations
+
+    def _read_user(self, user_id):
+        row = self._conn.execute("SELECT data FROM user_data WHERE user_id = ?", (user_id,)).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    async def refresh_user_data(self, user_id, user_data):
+        if user_id in self._loaded_users:
+            return
+        self._loaded_users.add(user_id)
+        if user_id in self._spilled_users:
+            self._spilled_users.discard(user_id)
+            pending = self._dirty_users if user_id in self._dirty_users else self._writing_users
+            if user_id in pending:
+                data = pickle.loads(pending[user_id]) if pending[user_id] else None
+            else:
+                data = await self._run(self._read_user, user_id)
+        elif user_id in self._dirty_users:
+            return
+        else:
+            data = await self._run(self._read_user, user_id)
+        if data:
+            self.loaded += 1
+            for key, value in data.items():
+                user_data.setdefault(key, value)
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    def spill_user_data(self, user_id, data):
+        self._loaded_users.discard(user_id)
+        self._spilled_users.add(user_id)
+        self._evicted_users.add(user_id)
+        if data:
+            self._dirty_users[user_id] = pickle.dumps(dict(data), protocol=pickle.HIGHEST_PROTOCOL)
+            self._schedule_commit()
+
+    async def update_user_data(self, user_id, data):
+        self._spilled_users.discard(user_id)
+        self._loaded_users.add(user_id)
+        self._dirty_users[user_id] = pickle.dumps(dict(data), protocol=pickle.HIGHEST_PROTOCOL) if data else None
+        self._schedule_commit()
+
+    async def drop_user_data(self, user_id):
+        if user_id in self._evicted_users:
+            self._evicted_users.discard(user_id)
+            return
+        self._loaded_users.discard(user_id)
+        self._spilled_users.discard(user_id)
+        self._dirty_users[user_id] = None
+        self._schedule_commit()
+
+    async def update_conversation(self, name, key, new_state):
+        self._dirty_conversations[(name, json.dumps(list(key)))] = None if new_state is None else json.dumps(new_state)
+        self._schedule_commit()
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    def _schedule_commit(self):
+        if self._commit_task is None or self._commit_task.done():
+            self._commit_task = asyncio.get_running_loop().create_task(self._commit())
+
+    def _write(self, users, conversations):
+        now = time.time()
+        with self._conn:
+            self._conn.executemany("DELETE FROM user_data WHERE user_id = ?",
+                                   [(user_id,) for user_id, blob in users.items() if blob is None])
+            self._conn.executemany("INSERT OR REPLACE INTO user_data (user_id, updated, data) VALUES (?, ?, ?)",
+                                   [(user_id, now, blob) for user_id, blob in users.items() if blob is not None])
+            self._conn.executemany("DELETE FROM conversations WHERE name = ? AND key = ?",
+                                   [key for key, state in conversations.items() if state is None])
+            self._conn.executemany("INSERT OR REPLACE INTO conversations (name, key, updated, state) VALUES (?, ?, ?, ?)",
+                                   [(name, key, now, state) for (name, key), state in conversations.items() if state is not None])
+
+    async def _commit(self):
+        await asyncio.sleep(0)
+        while self._dirty_users or self._dirty_conversations:
+            users, self._dirty_users = self._dirty_users, {}
+            conversations, self._dirty_conversations = self._dirty_conversations, {}
+            self._writing_users = users
+            try:
+                await self._run(self._write, users, conversations)
+            except Exception as e:
+                logger.error("Failed to persist sessions: %s", e)
+                self._dirty_users = {**users, **self._dirty_users}
+                self._dirty_conversations = {**conversations, **self._dirty_conversations}
+                return
+            finally:
+                self._writing_users = {}
+            self.written += len(users) + len(conversations)
+
+    async def flush(self):
+        if self._commit_task is not None:
+            await self._commit_task
+        await self._commit()
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
+        logger.info("Session persistence flushed: %s keys written, %s sessions loaded lazily", self.written, self.loaded)
+
+
+def estimate_size(value):
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item) for item in value)
+    return size
+
+
+class SessionEvictor:
+    def __init__(self, ttl=6 * 3600, max_bytes=256 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._last_seen = OrderedDict()
+        self.sessions = 0
+        self.bytes = 0
+        self.evicted = {'ttl': 0, 'lru': 0}
+        self.evicted_bytes = {'ttl': 0, 'lru': 0}
+
+    def touch(self, user_id):
+        self._last_seen[user_id] = time.monotonic()
+        self._last_seen.move_to_end(user_id)
+
+    def _evict(self, application, user_id, size, reason):
+        if isinstance(application.persistence, SessionPersistence):
+            application.persistence.spill_user_data(user_id, application.user_data.get(user_id))
+        application.drop_user_data(user_id)
+        self._last_seen.pop(user_id, None)
+        self.evicted[reason] += 1
+        self.evicted_bytes[reason] += size
+
+    def run(self, application):
+        now = time.monotonic()
+        user_data = application.user_data
+        for user_id in user_data:
+            if user_id not in self._last_seen:
+                self._last_seen[user_id] = now
+                self._last_seen.move_to_end(user_id, last=False)
+        sizes = {user_id: estimate_size(user_data[user_id]) for user_id in self._last_seen if user_id in user_data}
+        total = sum(sizes.values())
+        evicted = 0
+        cutoff = now - self.ttl
+        for user_id, last_seen in list(self._last_seen.items()):
+            if last_seen >= cutoff and total <= self.max_bytes:
+                continue
+            if user_id not in sizes:
+                del self._last_seen[user_id]
+                continue
+            self._evict(application, user_id, sizes[user_id], 'ttl' if last_seen < cutoff else 'lru')
+            total -= sizes[user_id]
+            evicted += 1
+        self.sessions = len(sizes) - evicted
+        self.bytes = total
+        return evicted
+
+    async def job(self, context):
+        started = time.perf_counter()
+        evicted = self.run(context.application)
+        persistence = context.application.persistence
+        if isinstance(persistence, SessionPersistence):
+            await persistence.prune()
+        if evicted:
+            logger.info("Evicted %s idle sessions in %.3fs, %s sessions (%s bytes) remain in memory",
+                        evicted, time.perf_counter() - started, self.sessions, self.bytes)
@@ -0,0 +1,71 @@
+import logging
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+AVAILABLE = np is not None
+
+WEIGHTS = {
+    'age': 3.0,
+    'city': 2.0,
+    'recency': 1.0,
+    'popularity': 1.0,
+    'liked_you': 5.0,
+}
+AGE_SCALE = 5.0
+
+
+def column(values):
+    return np.frombuffer(values, dtype=values.typecode)
+
+
+def score_candidates(columns, viewer_slot, slots, liker_slots, weights=WEIGHTS):
+    age = column(columns.age)[slots].astype(np.float32)
+    city = column(columns.city)[slots]
+    registered = column(columns.registered)[slots].astype(np.float32)
+    likes_received = column(columns.likes_received)[slots].astype(np.float32)
+    viewer_age = columns.age[viewer_slot]
+    viewer_city = columns.city[viewer_slot]
+
+    score = weights['age'] / (1.0 + np.abs(age - viewer_age) / AGE_SCALE)
+    if viewer_city >= 0:
+        score += weights['city'] * (city == viewer_city)
+    span = registered.max() - registered.min()
+    if span > 0:
+        score += weights['recency'] * (registered - registered.min()) / span
+    popularity = np.log1p(likes_received)
+    if popularity.max() > 0:
+        score += weights['popularity'] * popularity / popularity.max()
+    if len(liker_slots):
+        score += weights['liked_you'] * np.isin(slots, liker_slots)
+    return score
+
+
+def rank_candidates(store, viewer_id, candidate_ids, limit=200, weights=WEIGHTS):
+    columns = store.columns
+    if not AVAILABLE or len(candidate_ids) < 2 or viewer_id not in columns.slots:
+        return candidate_ids
+    slot_of = columns.slots
+    slots = np.fromiter(map(slot_of.__getitem__, candidate_ids), dtype=np.int64, count=len(candidate_ids))
+    seen = store.seen_slots(viewer_id)
+    if len(seen):
+        slots = slots[~np.isin(slots, column(seen))]
+        if len(slots) < 2:
+            return array('q', column(columns.ids)[slots].tobytes())
+    liker_slots = np.fromiter((slot_of[t] for t in store.likers_of(viewer_id) if t in slot_of), dtype=np.int64)
+    score = score_candidates(columns, slot_of[viewer_id], slots, liker_slots, weights)
+
+    if len(slots) > limit:
+        top = np.argpartition(-score, limit - 1)[:limit]
+    else:
+        top = np.arange(len(slots))
+    top = top[np.argsort(-score[top], kind='stable')]
+    rest = np.ones(len(slots), dtype=bool)
+    rest[top] = False
+    ordered = np.concatenate((slots[top], slots[rest]))
+    return array('q', column(columns.ids)[ordered].tobytes())
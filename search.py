@@ -0,0 +1,78 @@
+import re
+from functools import lru_cache
+
+TOKEN_RE = re.compile(r'[^\W_]+')
+
+STOP_WORDS = frozenset({
+    'и', 'в', 'во', 'на', 'с', 'со', 'не', 'но', 'а', 'я', 'по', 'к', 'ко', 'у', 'о', 'об', 'за', 'из', 'от', 'до',
+    'для', 'что', 'как', 'это', 'мне', 'меня', 'мой', 'моя', 'мои', 'или', 'то', 'же', 'бы', 'ли', 'вы', 'мы', 'ты',
+    'the', 'and', 'or', 'of', 'in', 'to', 'a', 'an', 'is', 'i',
+})
+
+REFLEXIVE_ENDINGS = frozenset({'ся', 'сь'})
+ENDINGS = frozenset({
+    'иями', 'ями', 'ами', 'ием', 'иях', 'иям', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ешь', 'ишь', 'ете', 'ите',
+    'ает', 'яет', 'ать', 'ять', 'ить', 'еть', 'ах', 'ях', 'ам', 'ям', 'ов', 'ев', 'ей', 'ий', 'ый', 'ой', 'ая',
+    'яя', 'ое', 'ее', 'ые', 'ие', 'ую', 'юю', 'ом', 'ем', 'ым', 'им', 'ия', 'ии', 'ию', 'ть', 'ет', 'ут', 'ют',
+    'ит', 'ат', 'ят', 'ал', 'ял', 'ил', 'ла', 'ло', 'ли', 'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+})
+ENDING_LENGTHS = sorted({len(ending) for ending in ENDINGS}, reverse=True)
+MIN_STEM = 3
+
+
+def fold(text):
+    return text.casefold().replace('ё', 'е')
+
+
+@lru_cache(maxsize=65536)
+def stem(word):
+    if word[-2:] in REFLEXIVE_ENDINGS and len(word) - 2 >= MIN_STEM:
+        word = word[:-2]
+    for length in ENDING_LENGTHS:
+        if len(word) - length >= MIN_STEM and word[-length:] in ENDINGS:
+            return word[:-length]
+    return word
+
+
+@lru_cache(maxsize=4096)
+def terms(text):
+    return frozenset(stem(token) for token in TOKEN_RE.findall(fold(text or '')) if len(token) > 1 and token not in STOP_WORDS)
+
+
+def profile_terms(user):
+    return terms(user.get('bio')) | terms(user.get('gender'))
+
+
+class TextIndex:
+    def __init__(self):
+        self._postings = {}
+
+    def add(self, user, previous=None):
+        telegram_id = user['telegram_id']
+        new_terms = profile_terms(user)
+        old_terms = profile_terms(previous) if previous is not None else frozenset()
+        for term in old_terms - new_terms:
+            self._discard(term, telegram_id)
+        for term in new_terms - old_terms:
+            self._postings.setdefault(term, set()).add(telegram_id)
+
+    def remove(self, user):
+        for term in profile_terms(user):
+            self._discard(term, user['telegram_id'])
+
+    def _discard(self, term, telegram_id):
+        posting = self._postings.get(term)
+        if posting is not None:
+            posting.discard(telegram_id)
+            if not posting:
+                del self._postings[term]
+
+    def search(self, query):
+        query_terms = terms(query)
+        if not query_terms:
+            return set()
+        postings = sorted((self._postings.get(term, set()) for term in query_terms), key=len)
+        return postings[0].intersection(*postings[1:])
+
+    def snapshot(self):
+        return {term: set(ids) for term, ids in self._postings.items()}
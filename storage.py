@@ -0,0 +1,1434 @@
+import asyncio
+import base64
+import json
+import logging
+import os
+import pathlib
+import re
+import shutil
+import sqlite3
+import struct
+import time
+from array import array
+from bisect import bisect_left
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+
+from search import TextIndex
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_city(city):
+    if not city:
+        return None
+    return ' '.join(city.split()).casefold().replace('ё', 'е')
+
+
+def age_bracket(age):
+    return 'minor' if age < 18 else 'adult'
+
+
+class CandidateIndex:
+    def __init__(self):
+        self._order = {}
+        self._keys = {}
+        self._buckets = {}
+        self._brackets = {}
+        self._next_order = 0
+
+    def add(self, user):
+        telegram_id = user['telegram_id']
+        self.remove(telegram_id, keep_order=True)
+        if telegram_id not in self._order:
+            self._order[telegram_id] = self._next_order
+            self._next_order += 1
+        bracket = age_bracket(user['age'])
+        key = (bracket, normalize_city(user.get('city')))
+        self._keys[telegram_id] = key
+        self._buckets.setdefault(key, set()).add(telegram_id)
+        self._brackets.setdefault(bracket, set()).add(telegram_id)
+
+    def remove(self, telegram_id, keep_order=False):
+        key = self._keys.pop(telegram_id, None)
+        if key is not None:
+            self._buckets[key].discard(telegram_id)
+            self._brackets[key[0]].discard(telegram_id)
+        if not keep_order:
+            self._order.pop(telegram_id, None)
+
+    def candidates(self, user, excluded=()):
+        bracket = age_bracket(user['age'])
+        city = normalize_city(user.get('city'))
+        if city:
+            pool = self._buckets.get((bracket, city), set()) | self._buckets.get((bracket, None), set())
+        else:
+            pool = self._brackets.get(bracket, set())
+        own_id = user['telegram_id']
+        result = [t for t in pool if t != own_id and t not in excluded]
+        result.sort(key=self._order.__getitem__)
+        return result
+
+    def restrict(self, user, telegram_ids, excluded=()):
+        bracket = age_bracket(user['age'])
+        city = normalize_city(user.get('city'))
+        if city:
+            pools = (self._buckets.get((bracket, city), set()), self._buckets.get((bracket, None), set()))
+        else:
+            pools = (self._brackets.get(bracket, set()),)
+        result = set().union(*(pool.intersection(telegram_ids) for pool in pools))
+        result.discard(user['telegram_id'])
+        result.difference_update(excluded)
+        return sorted(result, key=self._order.__getitem__)
+
+    def snapshot(self):
+        return {key: set(members) for key, members in self._buckets.items() if members}
+
+
+class SlotSet:
+    CHUNK_BITS = 16
+    ARRAY_LIMIT = 4096
+    HEADER = struct.Struct('<IBI')
+
+    def __init__(self):
+        self._chunks = {}
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, slot):
+        chunk = self._chunks.get(slot >> self.CHUNK_BITS)
+        if chunk is None:
+            return False
+        low = slot & 0xFFFF
+        if isinstance(chunk, bytearray):
+            return bool(chunk[low >> 3] & (1 << (low & 7)))
+        i = bisect_left(chunk, low)
+        return i < len(chunk) and chunk[i] == low
+
+    def add(self, slot):
+        key, low = slot >> self.CHUNK_BITS, slot & 0xFFFF
+        chunk = self._chunks.get(key)
+        if chunk is None:
+            chunk = self._chunks[key] = array('H')
+        if isinstance(chunk, bytearray):
+            if chunk[low >> 3] & (1 << (low & 7)):
+                return False
+            chunk[low >> 3] |= 1 << (low & 7)
+        else:
+            i = bisect_left(chunk, low)
+            if i < len(chunk) and chunk[i] == low:
+                return False
+            chunk.insert(i, low)
+            if len(chunk) > self.ARRAY_LIMIT:
+                bitmap = bytearray(8192)
+                for value in chunk:
+                    bitmap[value >> 3] |= 1 << (value & 7)
+                self._chunks[key] = bitmap
+        self._count += 1
+        return True
+
+    def slots(self):
+        result = array('q')
+        for key in sorted(self._chunks):
+            chunk, base = self._chunks[key], key << self.CHUNK_BITS
+            if isinstance(chunk, bytearray):
+                result.extend(base + (i << 3) + bit for i, byte in enumerate(chunk) if byte for bit in range(8) if byte >> bit & 1)
+            else:
+                result.extend(base + low for low in chunk)
+        return result
+
+    def to_bytes(self):
+        parts = []
+        for key in sorted(self._chunks):
+            chunk = self._chunks[key]
+            if isinstance(chunk, bytearray):
+                count = sum(bin(byte).count('1') for byte in chunk)
+                parts.append(self.HEADER.pack(key, 1, count) + bytes(chunk))
+            else:
+                parts.append(self.HEADER.pack(key, 0, len(chunk)) + chunk.tobytes())
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        slot_set = cls()
+        offset = 0
+        while offset < len(data):
+            key, kind, count = cls.HEADER.unpack_from(data, offset)
+            offset += cls.HEADER.size
+            if kind == 1:
+                slot_set._chunks[key] = bytearray(data[offset:offset + 8192])
+                offset += 8192
+            else:
+                chunk = array('H')
+                chunk.frombytes(data[offset:offset + 2 * count])
+                slot_set._chunks[key] = chunk
+                offset += 2 * count
+            slot_set._count += count
+        return slot_set
+
+    def dump(self):
+        return base64.b64encode(self.to_bytes()).decode('ascii')
+
+    @classmethod
+    def load(cls, text):
+        return cls.from_bytes(base64.b64decode(text))
+
+
+class UserColumns:
+    def __init__(self):
+        self.slots = {}
+        self.ids = array('q')
+        self.age = array('h')
+        self.city = array('i')
+        self.registered = array('q')
+        self.likes_received = array('i')
+        self._city_codes = {}
+        self._clock = 0
+
+    def city_code(self, city):
+        city = normalize_city(city)
+        if city is None:
+            return -1
+        code = self._city_codes.get(city)
+        if code is None:
+            code = self._city_codes[city] = len(self._city_codes)
+        return code
+
+    def reserve(self, telegram_id):
+        slot = self.slots.get(telegram_id)
+        if slot is None:
+            slot = self.slots[telegram_id] = len(self.ids)
+            self.ids.append(telegram_id)
+            self.age.append(0)
+            self.city.append(-1)
+            self.registered.append(0)
+            self.likes_received.append(0)
+        return slot
+
+    def set_user(self, user, registered=False):
+        slot = self.reserve(user['telegram_id'])
+        self.age[slot] = user['age']
+        self.city[slot] = self.city_code(user.get('city'))
+        if registered or not self.registered[slot]:
+            self._clock += 1
+            self.registered[slot] = self._clock
+        return slot
+
+    def add_like_received(self, telegram_id):
+        slot = self.slots.get(telegram_id)
+        if slot is not None:
+            self.likes_received[slot] += 1
+
+
+class Store:
+    def __init__(self, data=None):
+        data = data or {}
+        self._users = {}
+        self._versions = {}
+        self._index = CandidateIndex()
+        self._text = TextIndex()
+        self.columns = UserColumns()
+        for telegram_id in data.get('slots', []):
+            self.columns.reserve(telegram_id)
+        for user in data.get('users', []):
+            self._users[user['telegram_id']] = user
+            self._index.add(user)
+            self._text.add(user)
+            self.columns.set_user(user)
+        self._tombstones = {}
+        for tombstone in data.get('banned', []):
+            self._tombstones[tombstone['telegram_id']] = tombstone
+        self._garbage = set()
+        self._protected = set()
+        self.blocked = []
+        self._blocked_by = {}
+        for block in data.get('blocked', []):
+            self._apply_block(block)
+            self._mark_orphans(block['blocker_id'], block['blocked_id'])
+        self.likes = []
+        self._like_edges = set()
+        self._likers = {}
+        self._inbox = {}
+        for like in data.get('likes', []):
+            self._apply_like(like)
+            self._mark_orphans(like['liker_id'], like['liked_id'])
+        self.skipped = []
+        for skip in data.get('skipped', []):
+            self._apply_like_skip(skip)
+        self._match_pairs = {}
+        self._matches_of = {}
+        for match in data.get('matches', []):
+            if match['user1_id'] in self._users and match['user2_id'] in self._users:
+                self._apply_match(match)
+        self.reports = list(data.get('reports', []))
+        self.feedback = list(data.get('feedback', []))
+        self._seen = {int(viewer_id): SlotSet.load(dump) for viewer_id, dump in data.get('seen', {}).items()}
+        self._pending_seen = {}
+        for viewer_id, telegram_ids in data.get('seen_ids', {}).items():
+            self._apply_seen({'viewer_id': viewer_id, 'telegram_ids': telegram_ids})
+        self.last_purge = None
+        self.revision = data.get('seq', 0)
+        self.updated_at = data.get('ts')
+        self.on_change = None
+        logger.info("Store initialized with %s users at seq %s", len(self._users), self.revision)
+
+    def get_user(self, telegram_id):
+        return self._users.get(telegram_id)
+
+    def user_version(self, telegram_id):
+        return self._versions.get(telegram_id, 0)
+
+    def has_user(self, telegram_id):
+        return telegram_id in self._users
+
+    def iter_users(self):
+        return iter(self._users.values())
+
+    def user_count(self):
+        return len(self._users)
+
+    def _emit(self, event):
+        self.revision += 1
+        event['seq'] = self.revision
+        event['ts'] = self.updated_at = time.time()
+        self.apply(event)
+        if self.on_change is not None:
+            self.on_change(event)
+
+    def apply(self, event):
+        getattr(self, f"_apply_{event['op']}")(event)
+
+    def replay(self, event):
+        if event['seq'] <= self.revision:
+            return False
+        self.apply(event)
+        self.revision = event['seq']
+        self.updated_at = event.get('ts', self.updated_at)
+        return True
+
+    def _mark_orphans(self, *telegram_ids):
+        for telegram_id in telegram_ids:
+            if telegram_id not in self._users and telegram_id not in self._protected:
+                self._garbage.add(telegram_id)
+
+    def _apply_user_add(self, event):
+        previous = self._users.get(event['user']['telegram_id'])
+        self._garbage.discard(event['user']['telegram_id'])
+        self._users[event['user']['telegram_id']] = event['user']
+        self._versions[event['user']['telegram_id']] = event['seq']
+        self._index.add(event['user'])
+        self._text.add(event['user'], previous)
+        self.columns.set_user(event['user'], registered=True)
+
+    def _apply_user_update(self, event):
+        previous = self._users.get(event['telegram_id'])
+        if previous is not None:
+            user = self._users[event['telegram_id']] = {**previous, **event['fields']}
+            self._versions[event['telegram_id']] = event['seq']
+            if 'age' in event['fields'] or 'city' in event['fields']:
+                self._index.add(user)
+                self.columns.set_user(user)
+            if 'bio' in event['fields'] or 'gender' in event['fields']:
+                self._text.add(user, previous)
+
+    def _apply_user_remove(self, event):
+        telegram_id = event['telegram_id']
+        user = self._users.pop(telegram_id, None)
+        if user is not None:
+            self._text.remove(user)
+        self._versions.pop(telegram_id, None)
+        self._index.remove(telegram_id)
+        for other_id in self._matches_of.pop(telegram_id, ()):
+            self._matches_of[other_id].pop(telegram_id, None)
+            self._match_pairs.pop((min(telegram_id, other_id), max(telegram_id, other_id)), None)
+        self._garbage.add(telegram_id)
+
+    def _apply_ban(self, event):
+        self._apply_user_remove(event)
+        self._seen.pop(event['telegram_id'], None)
+        self._pending_seen.pop(event['telegram_id'], None)
+        self._tombstones[event['telegram_id']] = {
+            'telegram_id': event['telegram_id'],
+            'banned_by': event['banned_by'],
+            'ts': event['ts'],
+        }
+
+    def _apply_purge(self, event):
+        ids = set(event['telegram_ids'])
+        likes = []
+        for like in self.likes:
+            if like['liker_id'] in ids or like['liked_id'] in ids:
+                self._like_edges.discard((like['liker_id'], like['liked_id']))
+                likers = self._likers.get(like['liked_id'])
+                if likers is not None:
+                    likers.discard(like['liker_id'])
+                    if not likers:
+                        del self._likers[like['liked_id']]
+                slot = self.columns.slots.get(like['liked_id'])
+                if slot is not None:
+                    self.columns.likes_received[slot] -= 1
+                inbox = self._inbox.get(like['liked_id'])
+                if inbox is not None:
+                    inbox.pop(like['liker_id'], None)
+                    if not inbox:
+                        del self._inbox[like['liked_id']]
+            else:
+                likes.append(like)
+        blocked = []
+        for block in self.blocked:
+            if block['blocker_id'] in ids or block['blocked_id'] in ids:
+                blocked_ids = self._blocked_by.get(block['blocker_id'])
+                if blocked_ids is not None:
+                    blocked_ids.discard(block['blocked_id'])
+                    if not blocked_ids:
+                        del self._blocked_by[block['blocker_id']]
+            else:
+                blocked.append(block)
+        self.last_purge = {'users': len(ids), 'likes': len(self.likes) - len(likes), 'blocked': len(self.blocked) - len(blocked)}
+        self.likes = likes
+        self.blocked = blocked
+        self.skipped = [skip for skip in self.skipped if skip['telegram_id'] not in ids and skip['liker_id'] not in ids]
+        self._garbage -= ids
+
+    def _apply_like(self, event):
+        edge = (event['liker_id'], event['liked_id'])
+        if edge in self._like_edges:
+            return
+        self._like_edges.add(edge)
+        self._likers.setdefault(edge[1], set()).add(edge[0])
+        self.columns.add_like_received(edge[1])
+        self.likes.append({'liker_id': edge[0], 'liked_id': edge[1]})
+        inbox = self._inbox.get(edge[0])
+        if inbox is not None:
+            inbox.pop(edge[1], None)
+        if (edge[1], edge[0]) not in self._like_edges:
+            self._inbox.setdefault(edge[1], {})[edge[0]] = None
+
+    def _apply_like_skip(self, event):
+        inbox = self._inbox.get(event['telegram_id'])
+        if inbox is not None:
+            inbox.pop(event['liker_id'], None)
+        self.skipped.append({'telegram_id': event['telegram_id'], 'liker_id': event['liker_id']})
+
+    def _apply_match(self, event):
+        pair = (event['user1_id'], event['user2_id'])
+        if pair in self._match_pairs:
+            return
+        self._match_pairs[pair] = None
+        self._matches_of.setdefault(pair[0], {})[pair[1]] = None
+        self._matches_of.setdefault(pair[1], {})[pair[0]] = None
+
+    def _apply_block(self, event):
+        blocked_ids = self._blocked_by.setdefault(event['blocker_id'], set())
+        if event['blocked_id'] in blocked_ids:
+            return
+        blocked_ids.add(event['blocked_id'])
+        self.blocked.append({'blocker_id': event['blocker_id'], 'blocked_id': event['blocked_id']})
+
+    def _apply_seen(self, event):
+        seen = self._seen.get(event['viewer_id'])
+        if seen is None:
+            seen = self._seen[event['viewer_id']] = SlotSet()
+        for telegram_id in event['telegram_ids']:
+            seen.add(self.columns.reserve(telegram_id))
+
+    def _apply_seen_reset(self, event):
+        self._seen.pop(event['viewer_id'], None)
+        self._pending_seen.pop(event['viewer_id'], None)
+
+    def _apply_report(self, event):
+        self.reports.append(event['report'])
+
+    def _apply_feedback(self, event):
+        self.feedback.append(event['entry'])
+
+    def add_user(self, profile):
+        self._emit({'op': 'user_add', 'user': profile})
+
+    def update_user(self, telegram_id, **fields):
+        if telegram_id not in self._users:
+            return False
+        self._emit({'op': 'user_update', 'telegram_id': telegram_id, 'fields': fields})
+        return True
+
+    def remove_user(self, telegram_id):
+        if telegram_id not in self._users:
+            return False
+        self._emit({'op': 'user_remove', 'telegram_id': telegram_id})
+        return True
+
+    def add_like(self, liker_id, liked_id):
+        if (liker_id, liked_id) in self._like_edges:
+            return False
+        self._emit({'op': 'like', 'liker_id': liker_id, 'liked_id': liked_id})
+        return True
+
+    def has_like(self, liker_id, liked_id):
+        return (liker_id, liked_id) in self._like_edges
+
+    def likers_of(self, telegram_id):
+        return self._likers.get(telegram_id, frozenset())
+
+    def add_match(self, user_a, user_b):
+        pair = (min(user_a, user_b), max(user_a, user_b))
+        if pair in self._match_pairs:
+            return False
+        self._emit({'op': 'match', 'user1_id': pair[0], 'user2_id': pair[1]})
+        return True
+
+    def has_seen(self, viewer_id, telegram_id):
+        seen = self._seen.get(viewer_id)
+        slot = self.columns.slots.get(telegram_id)
+        return seen is not None and slot is not None and slot in seen
+
+    def seen_count(self, viewer_id):
+        return len(self._seen.get(viewer_id, ()))
+
+    def seen_slots(self, viewer_id):
+        seen = self._seen.get(viewer_id)
+        return seen.slots() if seen is not None else array('q')
+
+    def mark_seen(self, viewer_id, telegram_ids):
+        unseen = [t for t in telegram_ids if not self.has_seen(viewer_id, t)]
+        if unseen:
+            self._apply_seen({'viewer_id': viewer_id, 'telegram_ids': unseen})
+            self._pending_seen.setdefault(viewer_id, []).extend(unseen)
+        return len(unseen)
+
+    def flush_seen(self):
+        pending, self._pending_seen = self._pending_seen, {}
+        for viewer_id, telegram_ids in pending.items():
+            self._emit({'op': 'seen', 'viewer_id': viewer_id, 'telegram_ids': telegram_ids})
+        return len(pending)
+
+    def reset_seen(self, viewer_id):
+        if viewer_id not in self._seen:
+            return 0
+        count = len(self._seen[viewer_id])
+        self._emit({'op': 'seen_reset', 'viewer_id': viewer_id})
+        return count
+
+    def is_banned(self, telegram_id):
+        return telegram_id in self._tombstones
+
+    def garbage_ids(self):
+        return self._garbage - self._protected
+
+    def adopt_legacy_bans(self, admin_id, convert=True):
+        self._protected.add(admin_id)
+        self._garbage.discard(admin_id)
+        if not convert:
+            return 0
+        banned_ids = dict.fromkeys(block['blocked_id'] for block in self.blocked if block['blocker_id'] == admin_id
+                                   and block['blocked_id'] not in self._users and block['blocked_id'] not in self._tombstones)
+        for telegram_id in banned_ids:
+            self._emit({'op': 'ban', 'telegram_id': telegram_id, 'banned_by': admin_id})
+        return len(banned_ids)
+
+    def purge(self, telegram_ids):
+        telegram_ids = sorted(t for t in telegram_ids if t not in self._users and t not in self._protected)
+        if not telegram_ids:
+            return {'users': 0, 'likes': 0, 'blocked': 0}
+        self._emit({'op': 'purge', 'telegram_ids': telegram_ids})
+        return self.last_purge
+
+    def _inbox_entries(self, telegram_id):
+        blocked_ids = self._blocked_by.get(telegram_id, ())
+        return (t for t in reversed(self._inbox.get(telegram_id, {})) if t in self._users and t not in blocked_ids)
+
+    def has_inbox(self, telegram_id):
+        return next(self._inbox_entries(telegram_id), None) is not None
+
+    def inbox_page(self, telegram_id, offset, limit):
+        return list(islice(self._inbox_entries(telegram_id), offset, offset + limit))
+
+    def in_inbox(self, telegram_id, liker_id):
+        return liker_id in self._inbox.get(telegram_id, ())
+
+    def skip_like(self, telegram_id, liker_id):
+        if not self.in_inbox(telegram_id, liker_id):
+            return False
+        self._emit({'op': 'like_skip', 'telegram_id': telegram_id, 'liker_id': liker_id})
+        return True
+
+    def has_match(self, user_a, user_b):
+        return (min(user_a, user_b), max(user_a, user_b)) in self._match_pairs
+
+    def add_block(self, blocker_id, blocked_id):
+        if blocked_id in self._blocked_by.get(blocker_id, ()):
+            return False
+        self._emit({'op': 'block', 'blocker_id': blocker_id, 'blocked_id': blocked_id})
+        return True
+
+    def blocked_ids(self, blocker_id):
+        return self._blocked_by.get(blocker_id, frozenset())
+
+    def is_blocked(self, blocker_id, blocked_id):
+        return blocked_id in self._blocked_by.get(blocker_id, ())
+
+    def candidates(self, telegram_id):
+        user = self._users.get(telegram_id)
+        if user is None:
+            return []
+        return self._index.candidates(user, self.blocked_ids(telegram_id))
+
+    def search(self, telegram_id, query):
+        user = self._users.get(telegram_id)
+        if user is None:
+            return []
+        return self._index.restrict(user, self._text.search(query), self.blocked_ids(telegram_id))
+
+    def check_index(self):
+        rebuilt = CandidateIndex()
+        rebuilt_text = TextIndex()
+        for user in self._users.values():
+            rebuilt.add(user)
+            rebuilt_text.add(user)
+        expected, actual = rebuilt.snapshot(), self._index.snapshot()
+        problems = []
+        if rebuilt_text.snapshot() != self._text.snapshot():
+            problems.append("text index differs from user profiles")
+        for key in sorted(set(expected) | set(actual), key=repr):
+            missing = expected.get(key, set()) - actual.get(key, set())
+            extra = actual.get(key, set()) - expected.get(key, set())
+            if missing:
+                problems.append(f"bucket {key}: missing {sorted(missing)}")
+            if extra:
+                problems.append(f"bucket {key}: unexpected {sorted(extra)}")
+        expected_blocked = {}
+        for block in self.blocked:
+            expected_blocked.setdefault(block['blocker_id'], set()).add(block['blocked_id'])
+        for blocker_id in set(expected_blocked) | set(self._blocked_by):
+            if expected_blocked.get(blocker_id, set()) != self._blocked_by.get(blocker_id, set()):
+                problems.append(f"blocked set of {blocker_id} differs from blocked rows")
+        for telegram_id in self._tombstones:
+            if telegram_id in self._users:
+                problems.append(f"banned user {telegram_id} is still registered")
+        expected_matches = {}
+        for a, b in self._match_pairs:
+            if a not in self._users or b not in self._users:
+                problems.append(f"match ({a}, {b}) references a removed user")
+            expected_matches.setdefault(a, set()).add(b)
+            expected_matches.setdefault(b, set()).add(a)
+        for telegram_id in set(expected_matches) | set(self._matches_of):
+            if expected_matches.get(telegram_id, set()) != set(self._matches_of.get(telegram_id, ())):
+                problems.append(f"match adjacency of {telegram_id} differs from match rows")
+        columns = self.columns
+        expected_inbox = {}
+        for liker_id, liked_id in self._like_edges:
+            if (liked_id, liker_id) not in self._like_edges:
+                expected_inbox.setdefault(liked_id, set()).add(liker_id)
+        for skip in self.skipped:
+            expected_inbox.get(skip['telegram_id'], set()).discard(skip['liker_id'])
+        for telegram_id in set(expected_inbox) | set(self._inbox):
+            if expected_inbox.get(telegram_id, set()) != set(self._inbox.get(telegram_id, ())):
+                problems.append(f"like inbox of {telegram_id} differs from like rows")
+        for telegram_id, user in self._users.items():
+            slot = columns.slots.get(telegram_id)
+            if slot is None:
+                problems.append(f"user {telegram_id} has no column slot")
+            elif columns.age[slot] != user['age'] or columns.city[slot] != columns.city_code(user.get('city')):
+                problems.append(f"column slot {slot} of user {telegram_id} is stale")
+        return problems
+
+    def add_report(self, report):
+        self._emit({'op': 'report', 'report': report})
+
+    def add_feedback(self, entry):
+        self._emit({'op': 'feedback', 'entry': entry})
+
+    def like(self, liker_id, liked_id):
+        if liker_id not in self._users or liked_id not in self._users:
+            return False
+        if not self.add_like(liker_id, liked_id):
+            return False
+        return self.has_like(liked_id, liker_id) and self.add_match(liker_id, liked_id)
+
+    def file_report(self, report):
+        self.add_report(report)
+        self.add_block(report['reporter_id'], report['reported_id'])
+
+    def ban_user(self, telegram_id, banned_by):
+        if telegram_id not in self._users:
+            return False
+        self._emit({'op': 'ban', 'telegram_id': telegram_id, 'banned_by': banned_by})
+        return True
+
+    def match_count(self, telegram_id=None):
+        if telegram_id is None:
+            return len(self._match_pairs)
+        return len(self._matches_of.get(telegram_id, ()))
+
+    def match_page(self, telegram_id, offset, limit):
+        return list(islice(reversed(self._matches_of.get(telegram_id, {})), offset, offset + limit))
+
+    def to_dict(self):
+        return {
+            "seq": self.revision,
+            "ts": self.updated_at,
+            "users": list(self._users.values()),
+            "blocked": list(self.blocked),
+            "likes": list(self.likes),
+            "matches": [{'user1_id': a, 'user2_id': b} for a, b in self._match_pairs],
+            "reports": list(self.reports),
+            "feedback": list(self.feedback),
+            "banned": list(self._tombstones.values()),
+            "skipped": list(self.skipped),
+            "slots": self.columns.ids.tolist(),
+            "seen": {str(viewer_id): seen.dump() for viewer_id, seen in self._seen.items() if len(seen)},
+        }
+
+
+def write_json_atomic(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+    return os.path.getsize(path)
+
+
+def copy_file_atomic(src, dst):
+    tmp_path = f"{dst}.tmp"
+    shutil.copyfile(src, tmp_path)
+    with open(tmp_path, 'rb') as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, dst)
+
+
+def read_snapshot_seq(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            head = f.read(64)
+    except OSError:
+        return 0
+    match = re.match(r'\{\s*"seq"\s*:\s*(\d+)', head)
+    return int(match.group(1)) if match else 0
+
+
+def encode_event(event):
+    return json.dumps(event, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+
+def append_journal(path, lines):
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(''.join(lines))
+        f.flush()
+        os.fsync(f.fileno())
+    return os.path.getsize(path)
+
+
+def read_journal(path):
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning("Ignoring torn journal record at %s:%s", path, line_no)
+                return
+
+
+def rewrite_journal(path, after_seq, segment_path=None):
+    tmp_path = f"{path}.tmp"
+    segment = open(f"{segment_path}.tmp", 'w', encoding='utf-8') if segment_path else None
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for event in read_journal(path):
+                if event['seq'] > after_seq:
+                    f.write(encode_event(event))
+                elif segment is not None:
+                    segment.write(encode_event(event))
+            f.flush()
+            os.fsync(f.fileno())
+        if segment is not None:
+            segment.flush()
+            os.fsync(segment.fileno())
+    finally:
+        if segment is not None:
+            segment.close()
+    if segment_path:
+        os.replace(f"{segment_path}.tmp", segment_path)
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+
+def replay_journal(store, path, until=None):
+    applied = 0
+    truncated = False
+    for event in read_journal(path):
+        if until is not None and event.get('ts', 0) > until:
+            truncated = True
+            break
+        if store.replay(event):
+            applied += 1
+    return applied, truncated
+
+
+class StoreWriter:
+    def __init__(self, store):
+        self.store = store
+        self._queue = asyncio.Queue()
+        self._task = None
+        self._closed = False
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, func, *args, **kwargs):
+        if self._closed:
+            raise RuntimeError("Store writer is closed")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((func, args, kwargs, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                break
+            func, args, kwargs, future = item
+            if future.cancelled():
+                continue
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+
+    async def close(self):
+        self._closed = True
+        if self._task is None:
+            return
+        self._queue.put_nowait(None)
+        await self._task
+        self._task = None
+
+
+class StorageBackend:
+    def __init__(self, flush_interval=2.0, flush_threshold=100):
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.store = None
+        self._buffer = []
+        self._executor = None
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._lock = asyncio.Lock()
+        self._stopping = False
+        self.on_io = None
+
+    def load(self):
+        raise NotImplementedError
+
+    def _encode(self, event):
+        raise NotImplementedError
+
+    def _write(self, items):
+        raise NotImplementedError
+
+    async def _maintenance(self):
+        pass
+
+    async def _finalize(self):
+        pass
+
+    def attach(self, store):
+        self.store = store
+        store.on_change = self.record
+
+    def _report_io(self, op, seconds, size):
+        if self.on_io is not None:
+            self.on_io(op, seconds, size)
+
+    @property
+    def dirty(self):
+        return bool(self._buffer)
+
+    @property
+    def buffered(self):
+        return len(self._buffer)
+
+    def record(self, event):
+        encoded = self._encode(event)
+        if isinstance(encoded, list):
+            self._buffer.extend(encoded)
+        else:
+            self._buffer.append(encoded)
+        if len(self._buffer) >= self.flush_threshold:
+            self._wakeup.set()
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        logger.info("%s started: flush every %ss or %s events",
+                    type(self).__name__, self.flush_interval, self.flush_threshold)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._stopping:
+                break
+            try:
+                self.store.flush_seen()
+                if self.dirty:
+                    await self.flush()
+                await self._maintenance()
+            except Exception as e:
+                logger.error("Background persistence failed: %s", e)
+
+    async def flush(self):
+        async with self._lock:
+            self.store.flush_seen()
+            await self._flush_buffer()
+
+    async def _flush_buffer(self):
+        items = self._buffer
+        if not items:
+            return
+        self._buffer = []
+        started = time.perf_counter()
+        try:
+            size = await asyncio.get_running_loop().run_in_executor(self._executor, self._write, items)
+        except Exception:
+            self._buffer = items + self._buffer
+            raise
+        self._report_io('flush', time.perf_counter() - started, size)
+
+    async def close(self):
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        await self._finalize()
+        logger.info("%s stopped, all changes persisted", type(self).__name__)
+
+
+class JsonBackend(StorageBackend):
+    def __init__(self, path, backup_path, journal_path, restore_path=None, restore_until=None,
+                 backup_interval=3600.0, compact_bytes=4 * 1024 * 1024, generations=24, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.backup_path = backup_path
+        self.journal_path = journal_path
+        self.restore_path = restore_path
+        self.restore_until = restore_until
+        self.backup_interval = backup_interval
+        self.compact_bytes = compact_bytes
+        self.generations = generations
+        self._snapshot_seq = 0
+        self._backup_seq = 0
+        self._journal_size = 0
+        self._retained_size = 0
+        self._last_compaction = time.monotonic()
+
+    def _load_snapshot(self):
+        if self.restore_path and os.path.exists(self.restore_path):
+            logger.info("Restoration file %s found. Applying to %s", self.restore_path, self.path)
+            try:
+                shutil.copyfile(self.restore_path, self.path)
+                os.remove(self.restore_path)
+                logger.info("Restored %s from %s", self.path, self.restore_path)
+            except Exception as e:
+                logger.error("Failed to restore database: %s", e)
+                raise Exception(f"Database restoration failed: {e}")
+
+        if not os.path.exists(self.path):
+            logger.warning("Database file %s not found. Initializing new database.", self.path)
+            return {}
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            logger.info("Successfully loaded database from %s", self.path)
+            logger.info("Number of users in database: %s", len(data['users']))
+            return data
+        except (json.JSONDecodeError, IOError) as e:
+            logger.error("Failed to load database from %s: %s", self.path, e)
+            if os.path.exists(self.backup_path):
+                logger.info("Attempting to load backup database from %s", self.backup_path)
+                try:
+                    with open(self.backup_path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                    logger.info("Successfully loaded backup database")
+                    logger.info("Number of users in backup database: %s", len(data['users']))
+                    write_json_atomic(self.path, data)
+                    return data
+                except (json.JSONDecodeError, IOError) as backup_e:
+                    logger.error("Failed to load backup database: %s", backup_e)
+            raise Exception(f"Database load failed: {e}. Backup also unavailable or corrupted.")
+
+    def read_store(self):
+        data = {}
+        for path in (self.path, self.backup_path):
+            if os.path.exists(path):
+                data = self._read_candidate(path) or {}
+                if data:
+                    break
+        store = Store(data)
+        if 'seq' in data:
+            replay_journal(store, self.journal_path)
+        return store
+
+    def _restore_pending(self):
+        try:
+            with open(self.path + '.restored', 'r', encoding='utf-8') as f:
+                applied = float(f.read().strip())
+        except (OSError, ValueError):
+            return True
+        if applied == self.restore_until:
+            logger.warning("Point-in-time restore to %s was already applied, ignoring DB_RESTORE_UNTIL", self.restore_until)
+            return False
+        return True
+
+    @staticmethod
+    def _read_candidate(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            logger.warning("Skipping unreadable snapshot %s: %s", path, e)
+            return None
+
+    def _generation_stamps(self):
+        directory, name = os.path.split(self.backup_path)
+        pattern = re.compile(re.escape(name) + r'\.(\d{8}-\d{6}-\d+)$')
+        try:
+            names = os.listdir(directory or '.')
+        except OSError:
+            return []
+        return sorted(match.group(1) for match in map(pattern.match, names) if match)
+
+    def _history(self):
+        for stamp in self._generation_stamps():
+            yield from read_journal(f"{self.journal_path}.{stamp}")
+        yield from read_journal(self.journal_path)
+
+    def _prune_generations(self):
+        stamps = self._generation_stamps()
+        for stamp in stamps[:max(0, len(stamps) - self.generations)]:
+            for path in (f"{self.backup_path}.{stamp}", f"{self.journal_path}.{stamp}"):
+                if os.path.exists(path):
+                    os.remove(path)
+            logger.info("Dropped snapshot generation %s", stamp)
+
+    def _restore_point_in_time(self):
+        cutoff_seq = 0
+        latest_seq = 0
+        for event in self._history():
+            latest_seq = max(latest_seq, event['seq'])
+            if event.get('ts', 0) <= self.restore_until:
+                cutoff_seq = max(cutoff_seq, event['seq'])
+        candidates = []
+        generations = [f"{self.backup_path}.{stamp}" for stamp in self._generation_stamps()]
+        for path in (self.path, self.backup_path, self.restore_path, *generations):
+            if not path or not os.path.exists(path):
+                continue
+            data = self._read_candidate(path)
+            if data is None or 'seq' not in data:
+                continue
+            latest_seq = max(latest_seq, data['seq'])
+            if data['seq'] <= cutoff_seq or (data.get('ts') is not None and data['ts'] <= self.restore_until):
+                candidates.append((data['seq'], path, data))
+        if not candidates:
+            raise Exception(f"Point-in-time restore failed: no snapshot at or before {self.restore_until}")
+        _, source, data = max(candidates, key=lambda candidate: candidate[0])
+        store = Store(data)
+        applied = 0
+        for event in self._history():
+            if event['seq'] <= store.revision:
+                continue
+            if event['seq'] != store.revision + 1 or event.get('ts', 0) > self.restore_until:
+                break
+            store.replay(event)
+            applied += 1
+        logger.info("Restored %s at seq %s and replayed %s journal events up to %s", source, data['seq'], applied, self.restore_until)
+        restored_seq = store.revision
+        store.revision = max(store.revision, latest_seq)
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        if os.path.exists(self.path):
+            copy_file_atomic(self.path, f"{self.path}.pre-restore-{stamp}")
+        if os.path.exists(self.journal_path):
+            os.replace(self.journal_path, f"{self.journal_path}.pre-restore-{stamp}")
+        if self.restore_path and os.path.exists(self.restore_path):
+            os.replace(self.restore_path, f"{self.restore_path}.applied-{stamp}")
+        write_json_atomic(self.path, store.to_dict())
+        with open(self.journal_path, 'w', encoding='utf-8') as f:
+            os.fsync(f.fileno())
+        with open(self.path + '.restored', 'w', encoding='utf-8') as f:
+            f.write(repr(self.restore_until))
+        logger.warning("Point-in-time restore to %s done at seq %s (renumbered to %s); previous snapshot and journal kept "
+                       "with suffix .pre-restore-%s", self.restore_until, restored_seq, store.revision, stamp)
+        return store
+
+    def load(self):
+        started = time.perf_counter()
+        if self.restore_until is not None and self._restore_pending():
+            store = self._restore_point_in_time()
+            self.attach(store)
+            self._snapshot_seq = store.revision
+            self._backup_seq = read_snapshot_seq(self.backup_path)
+            self._report_io('load', time.perf_counter() - started, os.path.getsize(self.path))
+            return store
+        data = self._load_snapshot()
+        store = Store(data)
+        needs_checkpoint = 'seq' not in data
+        if needs_checkpoint:
+            logger.info("Database has no journal position, skipping replay of %s", self.journal_path)
+        else:
+            applied, _ = replay_journal(store, self.journal_path)
+            logger.info("Replayed %s journal events from %s, database now at seq %s", applied, self.journal_path, store.revision)
+        self.attach(store)
+        if needs_checkpoint:
+            self.reset()
+        else:
+            self._snapshot_seq = read_snapshot_seq(self.path)
+            self._backup_seq = read_snapshot_seq(self.backup_path)
+            self._journal_size = os.path.getsize(self.journal_path) if os.path.exists(self.journal_path) else 0
+            self._retained_size = self._journal_size
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        self._report_io('load', time.perf_counter() - started, size + self._journal_size)
+        return store
+
+    def _encode(self, event):
+        return encode_event(event)
+
+    def _write(self, lines):
+        previous_size = self._journal_size
+        self._journal_size = append_journal(self.journal_path, lines)
+        logger.info("Appended %s events to %s", len(lines), self.journal_path)
+        return self._journal_size - previous_size
+
+    def _compaction_due(self):
+        if self.store.revision <= self._snapshot_seq:
+            return False
+        if self._journal_size - self._retained_size >= self.compact_bytes:
+            return True
+        return time.monotonic() - self._last_compaction >= self.backup_interval
+
+    async def _maintenance(self):
+        if self._compaction_due():
+            await self.compact()
+
+    async def _finalize(self):
+        if self._compaction_due():
+            await self.compact()
+
+    def _checkpoint(self, snapshot):
+        started = time.perf_counter()
+        segment_path = None
+        if self.generations and os.path.exists(self.backup_path):
+            stamp = f"{time.strftime('%Y%m%d-%H%M%S')}-{self._backup_seq}"
+            os.replace(self.backup_path, f"{self.backup_path}.{stamp}")
+            segment_path = f"{self.journal_path}.{stamp}"
+        if os.path.exists(self.path):
+            copy_file_atomic(self.path, self.backup_path)
+        backup_seq = self._snapshot_seq
+        size = write_json_atomic(self.path, snapshot)
+        journal_size = rewrite_journal(self.journal_path, backup_seq, segment_path) if os.path.exists(self.journal_path) else 0
+        if self.generations:
+            self._prune_generations()
+        logger.info("Compacted journal into %s at seq %s (%s bytes snapshot, %s bytes journal kept since seq %s, %.3fs)",
+                    self.path, snapshot['seq'], size, journal_size, backup_seq, time.perf_counter() - started)
+        return backup_seq, journal_size, size
+
+    async def compact(self):
+        async with self._lock:
+            await self._flush_buffer()
+            started = time.perf_counter()
+            snapshot = self.store.to_dict()
+            self._backup_seq, self._journal_size, size = await asyncio.get_running_loop().run_in_executor(
+                None, self._checkpoint, snapshot)
+            self._report_io('snapshot', time.perf_counter() - started, size)
+            self._snapshot_seq = snapshot['seq']
+            self._retained_size = self._journal_size
+            self._last_compaction = time.monotonic()
+
+    def reset(self):
+        snapshot = self.store.to_dict()
+        write_json_atomic(self.path, snapshot)
+        copy_file_atomic(self.path, self.backup_path)
+        with open(self.journal_path, 'w', encoding='utf-8') as f:
+            os.fsync(f.fileno())
+        self._snapshot_seq = self._backup_seq = snapshot['seq']
+        self._journal_size = self._retained_size = 0
+        logger.info("Database checkpointed at seq %s with an empty journal", snapshot['seq'])
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS users (telegram_id INTEGER PRIMARY KEY, created_seq INTEGER NOT NULL, data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS users_created ON users (created_seq);
+CREATE TABLE IF NOT EXISTS likes (liker_id INTEGER NOT NULL, liked_id INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS likes_liker_liked ON likes (liker_id, liked_id);
+CREATE TABLE IF NOT EXISTS matches (user1_id INTEGER NOT NULL, user2_id INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS matches_user1 ON matches (user1_id);
+CREATE INDEX IF NOT EXISTS matches_user2 ON matches (user2_id);
+CREATE UNIQUE INDEX IF NOT EXISTS matches_pair ON matches (min(user1_id, user2_id), max(user1_id, user2_id));
+CREATE TRIGGER IF NOT EXISTS users_delete_matches AFTER DELETE ON users BEGIN
+    DELETE FROM matches WHERE user1_id = OLD.telegram_id OR user2_id = OLD.telegram_id;
+END;
+CREATE TABLE IF NOT EXISTS blocked (blocker_id INTEGER NOT NULL, blocked_id INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS blocked_blocker ON blocked (blocker_id);
+CREATE TABLE IF NOT EXISTS reports (id INTEGER PRIMARY KEY AUTOINCREMENT, reporter_id INTEGER, reported_id INTEGER, data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS reports_reported ON reports (reported_id);
+CREATE TABLE IF NOT EXISTS feedback (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS banned (telegram_id INTEGER PRIMARY KEY, banned_by INTEGER, ts REAL);
+CREATE TABLE IF NOT EXISTS skipped (telegram_id INTEGER NOT NULL, liker_id INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS seen_profiles (viewer_id INTEGER NOT NULL, telegram_id INTEGER NOT NULL, PRIMARY KEY (viewer_id, telegram_id)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY AUTOINCREMENT, origin INTEGER NOT NULL, ts REAL NOT NULL, data TEXT NOT NULL);
+"""
+
+
+def dump_json(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+class SqliteBackend(StorageBackend):
+    def __init__(self, path, origin=None, event_retention=3600, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.origin = origin
+        self.event_retention = event_retention
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite-writer')
+        self._conn = None
+        self._event_cursor = 0
+        self._last_trim = 0
+        self.remote_events = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SQLITE_SCHEMA)
+        return conn
+
+    def _read_all(self, conn):
+        row = conn.execute("SELECT value FROM meta WHERE key = 'seq'").fetchone()
+        return {
+            'seq': int(row[0]) if row else 0,
+            'users': [json.loads(data) for (data,) in conn.execute("SELECT data FROM users ORDER BY created_seq")],
+            'likes': [{'liker_id': a, 'liked_id': b} for a, b in conn.execute("SELECT liker_id, liked_id FROM likes ORDER BY rowid")],
+            'matches': [{'user1_id': a, 'user2_id': b} for a, b in conn.execute("SELECT user1_id, user2_id FROM matches ORDER BY rowid")],
+            'blocked': [{'blocker_id': a, 'blocked_id': b} for a, b in conn.execute("SELECT blocker_id, blocked_id FROM blocked ORDER BY rowid")],
+            'reports': [json.loads(data) for (data,) in conn.execute("SELECT data FROM reports ORDER BY id")],
+            'feedback': [json.loads(data) for (data,) in conn.execute("SELECT data FROM feedback ORDER BY id")],
+            'banned': [{'telegram_id': a, 'banned_by': b, 'ts': c}
+                       for a, b, c in conn.execute("SELECT telegram_id, banned_by, ts FROM banned")],
+            'skipped': [{'telegram_id': a, 'liker_id': b} for a, b in conn.execute("SELECT telegram_id, liker_id FROM skipped ORDER BY rowid")],
+            'seen_ids': self._read_seen(conn),
+        }
+
+    @staticmethod
+    def _read_seen(conn):
+        seen = {}
+        for viewer_id, telegram_id in conn.execute("SELECT viewer_id, telegram_id FROM seen_profiles"):
+            seen.setdefault(viewer_id, []).append(telegram_id)
+        return seen
+
+    def read_store(self):
+        conn = sqlite3.connect(pathlib.Path(self.path).resolve().as_uri() + '?mode=ro', uri=True)
+        try:
+            return Store(self._read_all(conn))
+        finally:
+            conn.close()
+
+    def load(self):
+        self._conn = self._connect()
+        started = time.perf_counter()
+        self._conn.execute("BEGIN")
+        try:
+            data = self._read_all(self._conn)
+            self._event_cursor = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+        finally:
+            self._conn.commit()
+        store = Store(data)
+        elapsed = time.perf_counter() - started
+        logger.info("Loaded %s users from %s in %.3fs", store.user_count(), self.path, elapsed)
+        self.attach(store)
+        self._report_io('load', elapsed, os.path.getsize(self.path))
+        return store
+
+    def _encode(self, event):
+        encoded = self._encode_tables(event)
+        if self.origin is None or event['op'] in ('seen', 'seen_reset'):
+            return encoded
+        statements = encoded if isinstance(encoded, list) else [encoded]
+        statements = statements + [("INSERT INTO events (origin, ts, data) VALUES (?, ?, ?)",
+                                    (self.origin, event['ts'], dump_json(event)), event['seq'])]
+        if event['op'] == 'like':
+            pair = (event['liker_id'], event['liked_id'])
+            statements += [
+                ("INSERT OR IGNORE INTO matches (user1_id, user2_id) SELECT min(?1, ?2), max(?1, ?2) "
+                 "WHERE EXISTS (SELECT 1 FROM likes WHERE liker_id = ?2 AND liked_id = ?1) "
+                 "AND (SELECT COUNT(*) FROM users WHERE telegram_id IN (?1, ?2)) = 2", pair, event['seq']),
+                ("INSERT INTO events (origin, ts, data) SELECT -1, ?3, "
+                 "json_object('op', 'match', 'user1_id', min(?1, ?2), 'user2_id', max(?1, ?2), 'by', ?4) WHERE changes() > 0",
+                 (*pair, event['ts'], self.origin), event['seq']),
+            ]
+        return statements
+
+    def _encode_tables(self, event):
+        op = event['op']
+        if op in ('user_add', 'user_update'):
+            telegram_id = event['user']['telegram_id'] if op == 'user_add' else event['telegram_id']
+            return (
+                "INSERT INTO users (telegram_id, created_seq, data) "
+                "SELECT ?1, COALESCE((SELECT MAX(created_seq) FROM users), 0) + 1, ?2 "
+                "WHERE NOT EXISTS (SELECT 1 FROM banned WHERE telegram_id = ?1) "
+                "ON CONFLICT(telegram_id) DO UPDATE SET data = excluded.data",
+                (telegram_id, dump_json(self.store.get_user(telegram_id))),
+                event['seq']
+            )
+        if op == 'user_remove':
+            return ("DELETE FROM users WHERE telegram_id = ?", (event['telegram_id'],), event['seq'])
+        if op == 'ban':
+            return [
+                ("DELETE FROM users WHERE telegram_id = ?", (event['telegram_id'],), event['seq']),
+                ("DELETE FROM seen_profiles WHERE viewer_id = ?", (event['telegram_id'],), event['seq']),
+                ("INSERT OR REPLACE INTO banned (telegram_id, banned_by, ts) VALUES (?, ?, ?)",
+                 (event['telegram_id'], event['banned_by'], event['ts']), event['seq']),
+            ]
+        if op == 'purge':
+            ids = (dump_json(event['telegram_ids']),)
+            return [
+                ("DELETE FROM likes WHERE liker_id IN (SELECT value FROM json_each(?1)) "
+                 "OR liked_id IN (SELECT value FROM json_each(?1))", ids, event['seq']),
+                ("DELETE FROM blocked WHERE blocker_id IN (SELECT value FROM json_each(?1)) "
+                 "OR blocked_id IN (SELECT value FROM json_each(?1))", ids, event['seq']),
+                ("DELETE FROM skipped WHERE telegram_id IN (SELECT value FROM json_each(?1)) "
+                 "OR liker_id IN (SELECT value FROM json_each(?1))", ids, event['seq']),
+            ]
+        if op == 'seen':
+            return ("INSERT OR IGNORE INTO seen_profiles (viewer_id, telegram_id) SELECT ?1, value FROM json_each(?2)",
+                    (event['viewer_id'], dump_json(event['telegram_ids'])), event['seq'])
+        if op == 'seen_reset':
+            return ("DELETE FROM seen_profiles WHERE viewer_id = ?", (event['viewer_id'],), event['seq'])
+        if op == 'like':
+            return ("INSERT INTO likes (liker_id, liked_id) VALUES (?, ?)", (event['liker_id'], event['liked_id']), event['seq'])
+        if op == 'like_skip':
+            return ("INSERT INTO skipped (telegram_id, liker_id) VALUES (?, ?)", (event['telegram_id'], event['liker_id']), event['seq'])
+        if op == 'match':
+            return ("INSERT OR IGNORE INTO matches (user1_id, user2_id) VALUES (?, ?)", (event['user1_id'], event['user2_id']), event['seq'])
+        if op == 'block':
+            return ("INSERT INTO blocked (blocker_id, blocked_id) VALUES (?, ?)", (event['blocker_id'], event['blocked_id']), event['seq'])
+        if op == 'report':
+            report = event['report']
+            return ("INSERT INTO reports (reporter_id, reported_id, data) VALUES (?, ?, ?)",
+                    (report.get('reporter_id'), report.get('reported_id'), dump_json(report)), event['seq'])
+        if op == 'feedback':
+            entry = event['entry']
+            return ("INSERT INTO feedback (user_id, data) VALUES (?, ?)", (entry.get('user_id'), dump_json(entry)), event['seq'])
+        raise ValueError(f"Unknown event op: {op}")
+
+    def _write(self, statements):
+        with self._conn:
+            for sql, params, _ in statements:
+                self._conn.execute(sql, params)
+            self._conn.execute("INSERT INTO meta (key, value) VALUES ('seq', ?) "
+                               "ON CONFLICT(key) DO UPDATE SET value = MAX(CAST(value AS INTEGER), CAST(excluded.value AS INTEGER))",
+                               (str(statements[-1][2]),))
+        logger.info("Committed %s events to %s", len(statements), self.path)
+        return sum(len(p) if isinstance(p, (str, bytes)) else 8 for _, params, _ in statements for p in params)
+
+    def _read_events(self):
+        return self._conn.execute("SELECT id, origin, data FROM events WHERE id > ? ORDER BY id", (self._event_cursor,)).fetchall()
+
+    async def sync(self, skip_ops=()):
+        started = time.perf_counter()
+        rows = await asyncio.get_running_loop().run_in_executor(self._executor, self._read_events)
+        applied = []
+        for event_id, origin, data in rows:
+            self._event_cursor = event_id
+            if origin == self.origin:
+                continue
+            event = json.loads(data)
+            if event['op'] == 'match' and self.store.has_match(event['user1_id'], event['user2_id']):
+                continue
+            if event['op'] not in skip_ops:
+                self.store.apply(event)
+                applied.append(event)
+        self.remote_events += len(applied)
+        if rows:
+            self._report_io('sync', time.perf_counter() - started, sum(len(data) for _, _, data in rows))
+        return applied
+
+    def _trim_events(self):
+        with self._conn:
+            return self._conn.execute("DELETE FROM events WHERE ts < ?", (time.time() - self.event_retention,)).rowcount
+
+    async def _maintenance(self):
+        if self.origin is None or time.time() - self._last_trim < 60:
+            return
+        self._last_trim = time.time()
+        trimmed = await asyncio.get_running_loop().run_in_executor(self._executor, self._trim_events)
+        if trimmed:
+            logger.info("Trimmed %s replicated events older than %ss", trimmed, self.event_retention)
+
+    async def _finalize(self):
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._conn.close)
+        self._executor.shutdown(wait=True)
+
+
+def migrate_json_to_sqlite(json_path, sqlite_path, journal_path=None):
+    with open(json_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if journal_path and 'seq' in data:
+        store = Store(data)
+        applied, _ = replay_journal(store, journal_path)
+        logger.info("Replayed %s journal events from %s before import", applied, journal_path)
+        data = store.to_dict()
+    backend = SqliteBackend(sqlite_path)
+    conn = backend._connect()
+    try:
+        if conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]:
+            raise Exception(f"{sqlite_path} already contains users, refusing to import over it")
+        with conn:
+            for position, user in enumerate(data.get('users', [])):
+                conn.execute("INSERT INTO users (telegram_id, created_seq, data) VALUES (?, ?, ?)",
+                             (user['telegram_id'], position - len(data['users']), dump_json(user)))
+            conn.executemany("INSERT INTO likes (liker_id, liked_id) VALUES (?, ?)",
+                             [(l['liker_id'], l['liked_id']) for l in data.get('likes', [])])
+            conn.executemany("INSERT OR IGNORE INTO matches (user1_id, user2_id) VALUES (?, ?)",
+                             [(m['user1_id'], m['user2_id']) for m in data.get('matches', [])])
+            conn.executemany("INSERT INTO blocked (blocker_id, blocked_id) VALUES (?, ?)",
+                             [(b['blocker_id'], b['blocked_id']) for b in data.get('blocked', [])])
+            conn.executemany("INSERT INTO reports (reporter_id, reported_id, data) VALUES (?, ?, ?)",
+                             [(r.get('reporter_id'), r.get('reported_id'), dump_json(r)) for r in data.get('reports', [])])
+            conn.executemany("INSERT INTO feedback (user_id, data) VALUES (?, ?)",
+                             [(e.get('user_id'), dump_json(e)) for e in data.get('feedback', [])])
+            conn.executemany("INSERT INTO banned (telegram_id, banned_by, ts) VALUES (?, ?, ?)",
+                             [(b['telegram_id'], b.get('banned_by'), b.get('ts')) for b in data.get('banned', [])])
+            conn.executemany("INSERT INTO skipped (telegram_id, liker_id) VALUES (?, ?)",
+                             [(s['telegram_id'], s['liker_id']) for s in data.get('skipped', [])])
+            slot_ids = data.get('slots', [])
+            conn.executemany("INSERT INTO seen_profiles (viewer_id, telegram_id) VALUES (?, ?)",
+                             [(int(v), slot_ids[slot]) for v, dump in data.get('seen', {}).items()
+                              for slot in SlotSet.load(dump).slots() if slot < len(slot_ids)])
+            conn.execute("INSERT INTO meta (key, value) VALUES ('seq', ?) "
+                         "ON CONFLICT(key) DO UPDATE SET value = excluded.value", (str(data.get('seq', 0)),))
+        counts = {name: len(data.get(name, [])) for name in ('users', 'likes', 'matches', 'blocked', 'reports', 'feedback', 'banned', 'skipped')}
+        logger.info("Imported %s into %s: %s", json_path, sqlite_path, counts)
+        return counts
+    finally:
+        conn.close()
@@ -0,0 +1,147 @@
+import asyncio
+import hmac
+import json
+import logging
+import signal
+import time
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+MAX_BODY_BYTES = 1024 * 1024
+
+
+class WebhookServer:
+    def __init__(self, application, listen='0.0.0.0', port=8443, path='webhook', secret_token=None, wait_for_handlers=False,
+                 metrics=None, dispatch=None, health=None):
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.path = '/' + path.strip('/')
+        self.secret_token = secret_token
+        self.wait_for_handlers = wait_for_handlers
+        self.metrics = metrics
+        self.dispatch = dispatch
+        self.health = health
+        self.received = 0
+        self.rejected = 0
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.listen, self.port)
+        logger.info("Webhook endpoint listening on %s:%s%s", self.listen, self.port, self.path)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        logger.info("Webhook endpoint stopped after %s updates (%s rejected)", self.received, self.rejected)
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                if length > MAX_BODY_BYTES:
+                    await self._respond(writer, 413, close=True)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                path = target.split('?', 1)[0]
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                if method == 'GET' and path == '/metrics' and self.metrics is not None:
+                    await self._respond(writer, 200, close=not keep_alive, body=self.metrics.render().encode('utf-8'))
+                else:
+                    status = await self._dispatch(method, path, headers, body)
+                    await self._respond(writer, status, close=not keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError) as e:
+            logger.warning("Dropping webhook connection: %s", e)
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method, path, headers, body):
+        if method == 'GET' and path == '/health':
+            return 200 if self.health is None or self.health() else 503
+        if path != self.path:
+            return 404
+        if method != 'POST':
+            return 405
+        if self.secret_token and not hmac.compare_digest(headers.get(SECRET_HEADER, ''), self.secret_token):
+            self.rejected += 1
+            logger.warning("Rejected webhook request with a wrong secret token")
+            return 403
+        try:
+            data = json.loads(body)
+            if not isinstance(data, dict):
+                raise TypeError("update is not a JSON object")
+            update = None if self.dispatch is not None else Update.de_json(data, self.application.bot)
+        except (ValueError, KeyError, TypeError) as e:
+            self.rejected += 1
+            logger.warning("Rejected malformed webhook payload: %s", e)
+            return 400
+        self.received += 1
+        if self.dispatch is not None:
+            self.dispatch(data)
+        elif self.wait_for_handlers:
+            await self.application.process_update(update)
+        else:
+            await self.application.update_queue.put(update)
+        return 200
+
+    @staticmethod
+    async def _respond(writer, status, close=False, body=b''):
+        reason = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+                  405: 'Method Not Allowed', 413: 'Payload Too Large',
+                  503: 'Service Unavailable'}.get(status, 'Error')
+        connection = 'close' if close else 'keep-alive'
+        content_type = "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n" if body else ""
+        writer.write(f"HTTP/1.1 {status} {reason}\r\n{content_type}Content-Length: {len(body)}\r\n"
+                     f"Connection: {connection}\r\n\r\n".encode('latin-1') + body)
+        await writer.drain()
+
+
+async def serve_webhook(application, server, webhook_url=None, on_start=None, on_stop=None):
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, stop_event.set)
+        except NotImplementedError:
+            pass
+
+    await application.initialize()
+    if on_start is not None:
+        await on_start(application)
+    await application.start()
+    await server.start()
+    if webhook_url:
+        started = time.perf_counter()
+        await application.bot.set_webhook(
+            url=webhook_url,
+            secret_token=server.secret_token,
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=False
+        )
+        logger.info("Registered webhook %s in %.3fs", webhook_url, time.perf_counter() - started)
+    try:
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        await application.stop()
+        if on_stop is not None:
+            await on_stop(application)
+        await application.shutdown()
@@ -0,0 +1,70 @@
+import argparse
+import json
+import statistics
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def load_updates(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read().strip()
+    if text.startswith('['):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def post_update(url, secret_token, update):
+    body = json.dumps(update, ensure_ascii=False).encode('utf-8')
+    request = urllib.request.Request(url, data=body, method='POST', headers={'Content-Type': 'application/json'})
+    if secret_token:
+        request.add_header('X-Telegram-Bot-Api-Secret-Token', secret_token)
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    return status, time.perf_counter() - started
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="POST recorded Telegram updates to the bot's webhook endpoint and report latency.")
+    parser.add_argument('updates', help="JSON array or JSON-lines file of recorded updates")
+    parser.add_argument('--url', default='http://127.0.0.1:8443/webhook')
+    parser.add_argument('--secret-token', default=None)
+    parser.add_argument('--repeat', type=int, default=1, help="send the recorded updates this many times")
+    parser.add_argument('--concurrency', type=int, default=1)
+    args = parser.parse_args()
+
+    updates = load_updates(args.updates)
+    batch = []
+    for round_no in range(args.repeat):
+        for update in updates:
+            update = dict(update)
+            update['update_id'] = update.get('update_id', 0) + round_no * len(updates)
+            batch.append(update)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda u: post_update(args.url, args.secret_token, u), batch))
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency * 1000 for status, latency in results if status == 200]
+    failures = [status for status, _ in results if status != 200]
+    print(f"sent {len(batch)} updates in {elapsed:.3f}s ({len(batch) / elapsed:.1f} updates/s), {len(failures)} failed")
+    if latencies:
+        print(f"latency ms: p50={percentile(latencies, 0.5):.2f} p90={percentile(latencies, 0.9):.2f} "
+              f"p99={percentile(latencies, 0.99):.2f} max={max(latencies):.2f} mean={statistics.mean(latencies):.2f}")
+    if failures:
+        print(f"failure statuses: {sorted(set(failures))}")
+
+
+if __name__ == '__main__':
+    main()